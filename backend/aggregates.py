@@ -0,0 +1,476 @@
+"""
+Materialized class-level aggregates for teacher analytics.
+
+Small summary tables that answer the common teacher questions without Gemini
+writing GROUP BY queries over the raw tables:
+
+- agg_class_subject_marks  - per class + subject mark statistics
+- agg_student_attendance   - per student attendance percentage
+- agg_student_fees         - per student fee totals / pending amount
+
+They live in the school database next to the source tables and are exposed
+to ChatSQLHelper as extra ("virtual") tables in the teacher schema.
+
+Refresh is incremental: each source table's id high-water mark is stored in
+agg_refresh_state, and only the students / classes touched by newer rows are
+recomputed. A periodic full rebuild picks up edits and deletes.
+
+Source column names differ between schools, so definitions are built from the
+introspected schema using COLUMN_CANDIDATES; an aggregate whose columns can't
+be found is skipped.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+# logical column -> names tried in order
+COLUMN_CANDIDATES = {
+    "students.class": ["class", "class_name", "grade", "standard", "class_section"],
+    "academic_marks.subject": ["subject", "subject_name", "course"],
+    "academic_marks.marks": ["marks_obtained", "marks", "score", "obtained_marks"],
+    "academic_marks.max_marks": ["max_marks", "total_marks", "out_of"],
+    "attendance.status": ["status", "attendance_status", "present"],
+    "attendance.date": ["date", "attendance_date", "day", "att_date"],
+    "fee_payments.amount": ["amount", "amount_paid", "fee_amount", "total_amount", "paid_amount"],
+    "fee_payments.status": ["status", "payment_status"],
+    "fee_payments.date": ["payment_date", "paid_on", "due_date", "date"],
+}
+
+PRESENT_VALUES = "('present', 'p', '1', 'yes', 'true')"
+PENDING_VALUES = "('pending', 'due', 'unpaid', 'overdue', 'partial')"
+
+AGGREGATE_TABLES = ("agg_class_subject_marks", "agg_student_attendance", "agg_student_fees")
+
+# Keys per IN (...) statement during incremental refresh
+KEY_CHUNK = 500
+
+
+def _pick(columns: Dict[str, List[str]], logical: str) -> Optional[str]:
+    table = logical.split(".")[0]
+    available = {c.lower(): c for c in columns.get(table) or []}
+    for candidate in COLUMN_CANDIDATES[logical]:
+        if candidate in available:
+            return available[candidate]
+    return None
+
+
+class Aggregate:
+    """
+    One summary table.
+
+    select_sql: SELECT producing the table's rows, with a `{where}` slot that is
+                empty for a full rebuild or restricts to `key_expr IN (...)`.
+    changed_sql: SELECT DISTINCT keys touched by source rows with id in (%s, %s].
+    """
+
+    def __init__(self, name: str, source: str, description: str, ddl_columns: List[str],
+                 primary_key: List[str], key_column: str, key_expr: str,
+                 select_sql: str, changed_sql: str):
+        self.name = name
+        self.source = source
+        self.description = description
+        self.ddl_columns = ddl_columns
+        self.primary_key = primary_key
+        self.key_column = key_column
+        self.key_expr = key_expr
+        self.select_sql = select_sql
+        self.changed_sql = changed_sql
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.split()[0].strip("`") for c in self.ddl_columns]
+
+    def ddl(self) -> str:
+        cols = ",\n    ".join(self.ddl_columns + [f"PRIMARY KEY ({', '.join(self.primary_key)})"])
+        return f"CREATE TABLE IF NOT EXISTS {self.name} (\n    {cols}\n)"
+
+
+def build_aggregates(columns: Dict[str, List[str]]) -> List[Aggregate]:
+    """Aggregate definitions for the columns this school's tables actually have."""
+    aggs = []
+    cls = _pick(columns, "students.class")
+    if not cls:
+        return aggs
+
+    subject = _pick(columns, "academic_marks.subject")
+    marks = _pick(columns, "academic_marks.marks")
+    if subject and marks:
+        max_marks = _pick(columns, "academic_marks.max_marks")
+        pct = f"m.`{marks}` * 100.0 / NULLIF(m.`{max_marks}`, 0)" if max_marks else f"m.`{marks}`"
+        aggs.append(Aggregate(
+            name="agg_class_subject_marks",
+            source="academic_marks",
+            description="per class and subject: students, avg/min/max marks, avg_percent, below_40_count",
+            ddl_columns=[
+                "`class` VARCHAR(50) NOT NULL",
+                "`subject` VARCHAR(100) NOT NULL",
+                "students INT NOT NULL",
+                "entries INT NOT NULL",
+                "avg_marks DECIMAL(10,2) NULL",
+                "min_marks DECIMAL(10,2) NULL",
+                "max_marks DECIMAL(10,2) NULL",
+                "avg_percent DECIMAL(6,2) NULL",
+                "below_40_count INT NOT NULL",
+                "refreshed_at DATETIME NOT NULL",
+            ],
+            primary_key=["`class`", "`subject`"],
+            key_column="class",
+            key_expr=f"s.`{cls}`",
+            select_sql=f"""
+                SELECT s.`{cls}`, m.`{subject}`, COUNT(DISTINCT m.student_id), COUNT(*),
+                       ROUND(AVG(m.`{marks}`), 2), MIN(m.`{marks}`), MAX(m.`{marks}`),
+                       ROUND(AVG({pct}), 2),
+                       SUM(CASE WHEN {pct} < 40 THEN 1 ELSE 0 END),
+                       %s
+                FROM academic_marks m JOIN students s ON s.id = m.student_id
+                WHERE s.`{cls}` IS NOT NULL AND m.`{subject}` IS NOT NULL {{where}}
+                GROUP BY s.`{cls}`, m.`{subject}`
+            """,
+            changed_sql=f"""
+                SELECT DISTINCT s.`{cls}` FROM academic_marks m JOIN students s ON s.id = m.student_id
+                WHERE m.id > %s AND m.id <= %s
+            """,
+        ))
+
+    status = _pick(columns, "attendance.status")
+    if status:
+        day = _pick(columns, "attendance.date")
+        aggs.append(Aggregate(
+            name="agg_student_attendance",
+            source="attendance",
+            description="per student: class, days_total, days_present, attendance_percent, last_date",
+            ddl_columns=[
+                "student_id INT NOT NULL",
+                "`class` VARCHAR(50) NULL",
+                "days_total INT NOT NULL",
+                "days_present INT NOT NULL",
+                "attendance_percent DECIMAL(5,2) NULL",
+                "last_date DATE NULL",
+                "refreshed_at DATETIME NOT NULL",
+            ],
+            primary_key=["student_id"],
+            key_column="student_id",
+            key_expr="a.student_id",
+            select_sql=f"""
+                SELECT a.student_id, MAX(s.`{cls}`), COUNT(*),
+                       SUM(CASE WHEN LOWER(a.`{status}`) IN {PRESENT_VALUES} THEN 1 ELSE 0 END),
+                       ROUND(SUM(CASE WHEN LOWER(a.`{status}`) IN {PRESENT_VALUES} THEN 1 ELSE 0 END) * 100.0
+                             / COUNT(*), 2),
+                       {f"MAX(a.`{day}`)" if day else "NULL"},
+                       %s
+                FROM attendance a LEFT JOIN students s ON s.id = a.student_id
+                WHERE a.student_id IS NOT NULL {{where}}
+                GROUP BY a.student_id
+            """,
+            changed_sql="SELECT DISTINCT student_id FROM attendance WHERE id > %s AND id <= %s",
+        ))
+
+    amount = _pick(columns, "fee_payments.amount")
+    if amount:
+        fee_status = _pick(columns, "fee_payments.status")
+        fee_date = _pick(columns, "fee_payments.date")
+        pending = (
+            f"SUM(CASE WHEN LOWER(f.`{fee_status}`) IN {PENDING_VALUES} THEN f.`{amount}` ELSE 0 END)"
+            if fee_status else "NULL"
+        )
+        aggs.append(Aggregate(
+            name="agg_student_fees",
+            source="fee_payments",
+            description="per student: class, payments, total_amount, pending_amount, last_payment_date",
+            ddl_columns=[
+                "student_id INT NOT NULL",
+                "`class` VARCHAR(50) NULL",
+                "payments INT NOT NULL",
+                "total_amount DECIMAL(12,2) NULL",
+                "pending_amount DECIMAL(12,2) NULL",
+                "last_payment_date DATE NULL",
+                "refreshed_at DATETIME NOT NULL",
+            ],
+            primary_key=["student_id"],
+            key_column="student_id",
+            key_expr="f.student_id",
+            select_sql=f"""
+                SELECT f.student_id, MAX(s.`{cls}`), COUNT(*), SUM(f.`{amount}`), {pending},
+                       {f"MAX(f.`{fee_date}`)" if fee_date else "NULL"},
+                       %s
+                FROM fee_payments f LEFT JOIN students s ON s.id = f.student_id
+                WHERE f.student_id IS NOT NULL {{where}}
+                GROUP BY f.student_id
+            """,
+            changed_sql="SELECT DISTINCT student_id FROM fee_payments WHERE id > %s AND id <= %s",
+        ))
+    return aggs
+
+
+STATE_DDL = """
+CREATE TABLE IF NOT EXISTS agg_refresh_state (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    high_water_id BIGINT NOT NULL,
+    last_refresh DATETIME NULL,
+    last_full_refresh DATETIME NULL,
+    last_mode VARCHAR(12) NULL,
+    last_duration_ms INT NULL,
+    last_keys INT NULL
+)
+"""
+
+
+class AggregateManager:
+    """
+    connect: zero-arg callable returning a DB-API connection (mysql-connector style, %s params).
+    columns: zero-arg callable returning {table: [column, ...]} (the introspected schema).
+    """
+
+    def __init__(self, connect: Callable, columns: Callable[[], Dict[str, List[str]]],
+                 ready_ttl: float = 60):
+        self.connect = connect
+        self.columns = columns
+        self.ready_ttl = ready_ttl
+        self._ensured = set()
+        self._ready: Set[str] = set()
+        self._ready_at = 0.0
+        self._ready_lock = threading.Lock()
+
+    def aggregates(self) -> List[Aggregate]:
+        return build_aggregates(self.columns())
+
+    def ready_names(self) -> Set[str]:
+        """
+        Aggregates that have been refreshed at least once (any worker), i.e. that
+        exist and hold data. Re-read from agg_refresh_state every `ready_ttl` seconds.
+        """
+        with self._ready_lock:
+            if time.monotonic() - self._ready_at < self.ready_ttl:
+                return self._ready
+            self._ready_at = time.monotonic()
+        ready = set()
+        try:
+            conn = self.connect()
+            try:
+                cur = conn.cursor(buffered=True)
+                cur.execute("SELECT name FROM agg_refresh_state")
+                ready = {r[0] for r in cur.fetchall()}
+                cur.close()
+            finally:
+                conn.close()
+        except Exception:
+            # no state table yet (never refreshed, or no CREATE privilege): nothing to offer
+            pass
+        with self._ready_lock:
+            self._ready = ready
+        return ready
+
+    def schema_lines(self) -> List[str]:
+        """Lines for the Gemini schema prompt (only aggregates that are ready)."""
+        ready = self.ready_names()
+        return [
+            f"- {a.name}: {a.column_names}  ({a.description})"
+            for a in self.aggregates()
+            if a.name in ready
+        ]
+
+    @property
+    def table_names(self) -> List[str]:
+        return [a.name for a in self.aggregates()]
+
+    def _state(self, cur, name: str) -> Dict[str, Any]:
+        cur.execute(
+            "SELECT high_water_id, last_full_refresh FROM agg_refresh_state WHERE name = %s", (name,)
+        )
+        row = cur.fetchone()
+        return {"high_water_id": row[0], "last_full_refresh": row[1]} if row else {}
+
+    def _ensure(self, conn, agg: Aggregate):
+        if agg.name in self._ensured:
+            return
+        cur = conn.cursor()
+        cur.execute(STATE_DDL)
+        cur.execute(agg.ddl())
+        conn.commit()
+        cur.close()
+        self._ensured.add(agg.name)
+
+    def _refresh_one(self, conn, agg: Aggregate, full: bool) -> Dict[str, Any]:
+        start = time.perf_counter()
+        now = datetime.utcnow().replace(microsecond=0)
+        cur = conn.cursor(buffered=True)
+        state = self._state(cur, agg.name)
+        cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {agg.source}")
+        high_water = int(cur.fetchone()[0])
+        old_water = int(state.get("high_water_id", 0)) if state else 0
+
+        insert = f"INSERT INTO {agg.name} ({', '.join('`%s`' % c for c in agg.column_names)}) "
+        if full or not state or high_water < old_water:
+            mode = "full"
+            cur.execute(f"DELETE FROM {agg.name}")
+            cur.execute(insert + agg.select_sql.format(where=""), (now,))
+            keys = None
+        else:
+            mode = "incremental"
+            cur.execute(agg.changed_sql, (old_water, high_water))
+            keys = [r[0] for r in cur.fetchall() if r[0] is not None]
+            for i in range(0, len(keys), KEY_CHUNK):
+                chunk = keys[i:i + KEY_CHUNK]
+                marks = ", ".join(["%s"] * len(chunk))
+                cur.execute(f"DELETE FROM {agg.name} WHERE `{agg.key_column}` IN ({marks})", chunk)
+                cur.execute(
+                    insert + agg.select_sql.format(where=f"AND {agg.key_expr} IN ({marks})"),
+                    (now, *chunk),
+                )
+
+        duration_ms = int((time.perf_counter() - start) * 1000)
+        cur.execute(
+            """
+            REPLACE INTO agg_refresh_state
+            (name, high_water_id, last_refresh, last_full_refresh, last_mode, last_duration_ms, last_keys)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            (
+                agg.name, high_water, now,
+                now if mode == "full" else state.get("last_full_refresh"),
+                mode, duration_ms, len(keys) if keys is not None else None,
+            ),
+        )
+        conn.commit()
+        cur.close()
+        return {"name": agg.name, "mode": mode, "keys": len(keys) if keys is not None else None,
+                "duration_ms": duration_ms}
+
+    def refresh(self, full: bool = False) -> List[Dict[str, Any]]:
+        """Refresh every aggregate; a failing one is reported and doesn't stop the others."""
+        results = []
+        conn = self.connect()
+        try:
+            for agg in self.aggregates():
+                try:
+                    self._ensure(conn, agg)
+                    results.append(self._refresh_one(conn, agg, full))
+                except Exception as e:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    print(f"Aggregate refresh failed for {agg.name}:", e)
+                    results.append({"name": agg.name, "error": str(e)})
+        finally:
+            conn.close()
+        # pick up the new state on the next schema_lines()
+        self._ready_at = 0.0
+        return results
+
+    def status(self) -> List[Dict[str, Any]]:
+        conn = self.connect()
+        try:
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("SELECT * FROM agg_refresh_state ORDER BY name")
+                return cur.fetchall()
+            except Exception:
+                return []
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+
+
+@contextmanager
+def mysql_named_lock(connect: Callable, name: str):
+    """
+    Yields True if this process got MySQL lock `name` (GET_LOCK, no wait), so only
+    one uvicorn worker runs the refresh. Yields True when locking isn't available.
+    """
+    conn = None
+    got = True
+    try:
+        conn = connect()
+        cur = conn.cursor(buffered=True)
+        cur.execute("SELECT GET_LOCK(%s, 0)", (name,))
+        got = cur.fetchone()[0] == 1
+        cur.close()
+    except Exception:
+        got = True
+    try:
+        yield got
+    finally:
+        if conn is not None:
+            try:
+                cur = conn.cursor(buffered=True)
+                cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                cur.fetchone()
+                cur.close()
+            except Exception:
+                pass
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class AggregateRefresher:
+    """
+    Background thread: incremental refresh every `interval` seconds and a full
+    rebuild every `full_every` runs. `guard` is an optional context manager
+    factory yielding whether this worker should run (see mysql_named_lock).
+    """
+
+    def __init__(self, manager: AggregateManager, interval: float, full_every: int = 12,
+                 guard: Optional[Callable] = None):
+        self.manager = manager
+        self.interval = interval
+        self.full_every = max(int(full_every), 1)
+        self.guard = guard
+        self.runs = 0
+        self.skipped = 0
+        self.last_results: List[Dict[str, Any]] = []
+        self.last_run_at: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self, full: Optional[bool] = None) -> Optional[List[Dict[str, Any]]]:
+        """Per-aggregate results, or None when another worker holds the refresh lock."""
+        if full is None:
+            # first run is incremental (an aggregate without state is rebuilt anyway)
+            full = (self.runs + 1) % self.full_every == 0
+        with (self.guard() if self.guard else _always()) as should_run:
+            if not should_run:
+                self.skipped += 1
+                return None
+            results = self.manager.refresh(full=full)
+        self.runs += 1
+        self.last_results = results
+        self.last_run_at = datetime.utcnow().isoformat(timespec="seconds")
+        return results
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print("Aggregate refresh failed:", e)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="aggregate-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "full_every": self.full_every,
+            "runs": self.runs,
+            "skipped_not_leader": self.skipped,
+            "last_run_at": self.last_run_at,
+            "last_results": self.last_results,
+        }
+
+
+@contextmanager
+def _always():
+    yield True
@@ -0,0 +1,297 @@
+"""
+Benchmark: teacher analytics queries on raw tables vs the materialized
+aggregates (aggregates.py), on a synthetic school of 50k students.
+
+Also times a full rebuild and an incremental refresh after one day of
+attendance + one test's marks for a single class.
+
+Run from /backend:
+    python bench_aggregates.py                  # SQLite, 50k students, 60 attendance days
+    python bench_aggregates.py --students 10000 --days 200
+    python bench_aggregates.py --mysql bench_school   # scratch schema on the .env server
+                                                      # (created if missing, never MYSQL_DB)
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from aggregates import AggregateManager
+
+SUBJECTS = ["maths", "science", "english", "social", "hindi", "computer"]
+EXAMS = 2
+FEE_INSTALMENTS = 3
+
+COLUMNS = {
+    "students": ["id", "name", "class"],
+    "academic_marks": ["id", "student_id", "subject", "exam", "marks_obtained", "max_marks"],
+    "attendance": ["id", "student_id", "date", "status"],
+    "fee_payments": ["id", "student_id", "amount", "status", "payment_date"],
+}
+
+QUERIES = {
+    "class subject averages (one class)": (
+        """SELECT s.class, m.subject, AVG(m.marks_obtained), MIN(m.marks_obtained), MAX(m.marks_obtained)
+           FROM academic_marks m JOIN students s ON s.id = m.student_id
+           WHERE s.class = '9A' GROUP BY s.class, m.subject""",
+        "SELECT * FROM agg_class_subject_marks WHERE class = '9A'",
+    ),
+    "subject averages (whole school)": (
+        """SELECT m.subject, AVG(m.marks_obtained) FROM academic_marks m GROUP BY m.subject""",
+        """SELECT subject, SUM(avg_marks * entries) / SUM(entries) FROM agg_class_subject_marks
+           GROUP BY subject""",
+    ),
+    "attendance < 75% (one class)": (
+        """SELECT a.student_id,
+                  SUM(CASE WHEN a.status = 'present' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS pct
+           FROM attendance a JOIN students s ON s.id = a.student_id
+           WHERE s.class = '9A' GROUP BY a.student_id HAVING pct < 75""",
+        """SELECT student_id, attendance_percent FROM agg_student_attendance
+           WHERE class = '9A' AND attendance_percent < 75""",
+    ),
+    "pending fees by class (whole school)": (
+        """SELECT s.class, SUM(f.amount) FROM fee_payments f JOIN students s ON s.id = f.student_id
+           WHERE f.status = 'pending' GROUP BY s.class""",
+        "SELECT class, SUM(pending_amount) FROM agg_student_fees GROUP BY class",
+    ),
+}
+
+
+class _SQLiteConn:
+    """mysql-connector style surface (%s params, cursor kwargs) over sqlite3."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+
+    def cursor(self, buffered=False, dictionary=False):
+        return _SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class _SQLiteCursor:
+    def __init__(self, cur):
+        self._cur = cur
+
+    def execute(self, sql, params=()):
+        params = tuple(p.isoformat(" ") if isinstance(p, datetime) else p for p in params)
+        return self._cur.execute(sql.replace("%s", "?"), params)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self):
+        self._cur.close()
+
+
+def _classes():
+    return [f"{g}{s}" for g in range(1, 13) for s in "ABCD"]
+
+
+def populate(students, days, seq_sql, run):
+    """seq_sql(n) -> a SELECT producing column n = 1..N (dialect specific)."""
+    classes = _classes()
+    class_case = "CASE " + " ".join(
+        f"WHEN n % {len(classes)} = {i} THEN '{c}'" for i, c in enumerate(classes)
+    ) + " END"
+    subject_case = "CASE " + " ".join(
+        f"WHEN n % {len(SUBJECTS)} = {i} THEN '{s}'" for i, s in enumerate(SUBJECTS)
+    ) + " END"
+    per_student = len(SUBJECTS) * EXAMS
+
+    run(f"INSERT INTO students (id, name, class) SELECT n, 'student', {class_case} FROM ({seq_sql(students)}) q")
+    run(
+        f"""INSERT INTO academic_marks (id, student_id, subject, exam, marks_obtained, max_marks)
+            SELECT n, (n - 1) / {per_student} + 1, {subject_case}, n % {EXAMS},
+                   (n * 37 + (n / {per_student}) * 11) % 101, 100
+            FROM ({seq_sql(students * per_student)}) q"""
+    )
+    run(
+        f"""INSERT INTO attendance (id, student_id, date, status)
+            SELECT n, (n - 1) % {students} + 1, '2025-06-01',
+                   CASE WHEN (n * 7 + (n - 1) % {students}) % 9 = 0 THEN 'absent' ELSE 'present' END
+            FROM ({seq_sql(students * days)}) q"""
+    )
+    run(
+        f"""INSERT INTO fee_payments (id, student_id, amount, status, payment_date)
+            SELECT n, (n - 1) % {students} + 1, 5000,
+                   CASE WHEN n % 5 = 0 THEN 'pending' ELSE 'paid' END, '2025-06-01'
+            FROM ({seq_sql(students * FEE_INSTALMENTS)}) q"""
+    )
+
+
+DDL = [
+    "CREATE TABLE students (id INT PRIMARY KEY, name VARCHAR(50), class VARCHAR(10))",
+    """CREATE TABLE academic_marks (id INT PRIMARY KEY, student_id INT, subject VARCHAR(20), exam INT,
+       marks_obtained INT, max_marks INT)""",
+    "CREATE TABLE attendance (id INT PRIMARY KEY, student_id INT, date DATE, status VARCHAR(10))",
+    """CREATE TABLE fee_payments (id INT PRIMARY KEY, student_id INT, amount DECIMAL(10,2),
+       status VARCHAR(10), payment_date DATE)""",
+    "CREATE INDEX ix_marks_student ON academic_marks (student_id)",
+    "CREATE INDEX ix_att_student ON attendance (student_id)",
+    "CREATE INDEX ix_fee_student ON fee_payments (student_id)",
+    "CREATE INDEX ix_students_class ON students (class)",
+]
+
+BENCH_TABLES = ["students", "academic_marks", "attendance", "fee_payments",
+                "agg_class_subject_marks", "agg_student_attendance", "agg_student_fees", "agg_refresh_state"]
+
+
+def setup_sqlite(students, days):
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "school.sqlite3")
+    conn = sqlite3.connect(path)
+    for stmt in DDL:
+        conn.execute(stmt)
+
+    def seq(n):
+        return f"WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {n}) SELECT n FROM seq"
+
+    populate(students, days, seq, conn.execute)
+    conn.commit()
+    conn.close()
+    return lambda: _SQLiteConn(path), lambda: shutil.rmtree(tmp, ignore_errors=True)
+
+
+def setup_mysql(students, days, database):
+    from dotenv import load_dotenv
+    import mysql.connector
+
+    load_dotenv()
+    # the source tables are named like the real ones: never run against the school database
+    if database == os.environ.get("MYSQL_DB"):
+        raise SystemExit("--mysql needs a scratch schema, not MYSQL_DB")
+
+    def connect(db=database):
+        return mysql.connector.connect(
+            host=os.environ.get("MYSQL_HOST"),
+            user=os.environ.get("MYSQL_USER"),
+            password=os.environ.get("MYSQL_PASSWORD"),
+            database=db,
+            port=int(os.environ.get("MYSQL_PORT", 3306)),
+        )
+
+    server = connect(None)
+    server.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+    server.close()
+
+    conn = connect()
+    cur = conn.cursor()
+    for t in BENCH_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {t}")
+    for stmt in DDL:
+        cur.execute(stmt)
+    cur.execute(f"SET SESSION cte_max_recursion_depth = {students * days + 1}")
+
+    def seq(n):
+        return f"WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {n}) SELECT n FROM seq"
+
+    # MySQL integer division is DIV; '/' would produce decimals
+    populate(students, days, seq, lambda sql: cur.execute(sql.replace(" / ", " DIV ")))
+    conn.commit()
+    conn.close()
+
+    def teardown():
+        c = connect()
+        k = c.cursor()
+        for t in BENCH_TABLES:
+            k.execute(f"DROP TABLE IF EXISTS {t}")
+        c.close()
+
+    return connect, teardown
+
+
+def timed(connect, sql, repeat):
+    times = []
+    for _ in range(repeat):
+        conn = connect()
+        cur = conn.cursor(buffered=True)
+        start = time.perf_counter()
+        cur.execute(sql)
+        cur.fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+        conn.close()
+    return statistics.median(times)
+
+
+def append_day(connect, klass):
+    """One more attendance day and one more test for every student in `klass`."""
+    conn = connect()
+    cur = conn.cursor(buffered=True)
+    cur.execute("SELECT MAX(id) FROM attendance")
+    att_id = cur.fetchone()[0]
+    cur.execute("SELECT MAX(id) FROM academic_marks")
+    mark_id = cur.fetchone()[0]
+    cur.execute("SELECT id FROM students WHERE class = %s", (klass,))
+    ids = [r[0] for r in cur.fetchall()]
+    for i, sid in enumerate(ids, 1):
+        cur.execute("INSERT INTO attendance (id, student_id, date, status) VALUES (%s, %s, %s, %s)",
+                    (att_id + i, sid, "2025-09-01", "absent" if i % 4 == 0 else "present"))
+        cur.execute(
+            "INSERT INTO academic_marks (id, student_id, subject, exam, marks_obtained, max_marks) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            (mark_id + i, sid, "maths", 9, 50 + i % 50, 100),
+        )
+    conn.commit()
+    conn.close()
+    return len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=60, help="attendance rows per student")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mysql", metavar="SCRATCH_DB", help="run on MySQL in this scratch schema")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.mysql:
+        connect, teardown = setup_mysql(args.students, args.days, args.mysql)
+    else:
+        connect, teardown = setup_sqlite(args.students, args.days)
+    try:
+        rows = args.students * (1 + len(SUBJECTS) * EXAMS + args.days + FEE_INSTALMENTS)
+        print(f"{args.students} students, {rows} source rows ({'mysql' if args.mysql else 'sqlite'}), "
+              f"generated in {time.perf_counter() - start:.1f}s")
+
+        manager = AggregateManager(connect, lambda: COLUMNS)
+        start = time.perf_counter()
+        results = manager.refresh(full=True)
+        print(f"full refresh: {(time.perf_counter() - start) * 1000:.0f} ms  "
+              + ", ".join(f"{r['name']}={r.get('duration_ms', r.get('error'))}ms" for r in results))
+
+        touched = append_day(connect, "9A")
+        start = time.perf_counter()
+        results = manager.refresh()
+        print(f"incremental refresh after {touched} new attendance + marks rows: "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms  "
+              + ", ".join(f"{r['name']}: {r.get('keys')} keys" for r in results))
+
+        print()
+        print(f"{'query':40} {'raw ms':>9} {'agg ms':>9} {'speedup':>8}")
+        for label, (raw_sql, agg_sql) in QUERIES.items():
+            raw = timed(connect, raw_sql, args.repeat)
+            agg = timed(connect, agg_sql, args.repeat)
+            print(f"{label:40} {raw:>9.2f} {agg:>9.2f} {raw / max(agg, 1e-3):>7.0f}x")
+    finally:
+        teardown()
+
+
+if __name__ == "__main__":
+    main()
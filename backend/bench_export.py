@@ -0,0 +1,163 @@
+"""
+Benchmark: streaming export throughput and peak memory on a 1M-row table.
+
+Compares the old approach (fetchall() then encode everything) with
+export.stream_query() (unbuffered cursor, fetchmany chunks).
+
+Run from /backend:
+    python bench_export.py                 # synthetic attendance table in SQLite
+    python bench_export.py --mysql         # same table created in MySQL (.env settings)
+    python bench_export.py --rows 200000
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from export import iter_export, stream_query
+
+TABLE = "export_bench"
+
+
+class _SQLiteConn:
+    """Lets sqlite3 accept the mysql-connector style cursor(buffered=False) call."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+
+    def cursor(self, buffered=False):
+        return self._conn.cursor()
+
+    def close(self):
+        self._conn.close()
+
+
+def setup_sqlite(rows):
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "export_bench.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        f"CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY, student_id INTEGER, day TEXT, status TEXT, remarks TEXT)"
+    )
+    conn.execute(
+        f"""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+        INSERT INTO {TABLE}
+        SELECT n, n % 50000, date('2025-06-01', '+' || (n % 200) || ' days'),
+               CASE WHEN n % 7 = 0 THEN 'absent' ELSE 'present' END, 'ok'
+        FROM seq
+        """,
+        (rows,),
+    )
+    conn.commit()
+    conn.close()
+    return lambda: _SQLiteConn(path), lambda: shutil.rmtree(tmp, ignore_errors=True)
+
+
+def setup_mysql(rows):
+    from dotenv import load_dotenv
+    import mysql.connector
+
+    load_dotenv()
+
+    def connect():
+        return mysql.connector.connect(
+            host=os.environ.get("MYSQL_HOST"),
+            user=os.environ.get("MYSQL_USER"),
+            password=os.environ.get("MYSQL_PASSWORD"),
+            database=os.environ.get("MYSQL_DB"),
+            port=int(os.environ.get("MYSQL_PORT", 3306)),
+        )
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cur.execute(
+        f"CREATE TABLE {TABLE} (id INT PRIMARY KEY, student_id INT, day DATE, "
+        f"status VARCHAR(10), remarks VARCHAR(20))"
+    )
+    cur.execute(f"SET SESSION cte_max_recursion_depth = {rows + 1}")
+    cur.execute(
+        f"""
+        INSERT INTO {TABLE}
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {rows})
+        SELECT n, n % 50000, DATE_ADD('2025-06-01', INTERVAL n % 200 DAY),
+               IF(n % 7 = 0, 'absent', 'present'), 'ok'
+        FROM seq
+        """
+    )
+    conn.commit()
+    conn.close()
+
+    def teardown():
+        c = connect()
+        c.cursor().execute(f"DROP TABLE IF EXISTS {TABLE}")
+        c.close()
+
+    return connect, teardown
+
+
+def buffered_export(connect, fmt):
+    """What chat_endpoint did: load everything, then encode."""
+    conn = connect()
+    cur = conn.cursor(buffered=True) if not isinstance(conn, _SQLiteConn) else conn.cursor()
+    cur.execute(f"SELECT * FROM {TABLE}")
+    rows = cur.fetchall()
+
+    class _All:
+        description = cur.description
+
+        def __init__(self):
+            self.done = False
+
+        def fetchmany(self, size):
+            if self.done:
+                return []
+            self.done = True
+            return rows
+
+    total = sum(len(chunk) for chunk in iter_export(_All(), fmt, len(rows) or 1))
+    conn.close()
+    return total
+
+
+def streamed_export(connect, fmt):
+    return sum(len(chunk) for chunk in stream_query(connect, f"SELECT * FROM {TABLE}", fmt))
+
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    size = fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--mysql", action="store_true")
+    args = parser.parse_args()
+
+    connect, teardown = setup_mysql(args.rows) if args.mysql else setup_sqlite(args.rows)
+    try:
+        print(f"{args.rows} rows ({'mysql' if args.mysql else 'sqlite'})")
+        print(f"{'mode':10} {'format':7} {'MB out':>8} {'seconds':>8} {'rows/s':>10} {'peak MB':>8}")
+        for fmt in ("csv", "ndjson"):
+            for label, fn in (("buffered", buffered_export), ("streamed", streamed_export)):
+                size, elapsed, peak = measure(fn, connect, fmt)
+                print(f"{label:10} {fmt:7} {size / 1e6:>8.1f} {elapsed:>8.2f} "
+                      f"{args.rows / elapsed:>10.0f} {peak / 1e6:>8.1f}")
+    finally:
+        teardown()
+
+
+if __name__ == "__main__":
+    main()
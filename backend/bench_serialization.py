@@ -0,0 +1,80 @@
+"""
+Benchmark: /chat payload size and serialization time.
+
+Compares the old shape (list of dicts, stdlib json with default=str) with
+the columnar shape + serialization.dumps(), and gzip / brotli sizes.
+
+Run from /backend:
+    python bench_serialization.py
+"""
+
+import gzip
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import serialization
+from serialization import dumps, to_columnar
+
+ITERATIONS = 2000
+
+
+def make_rows(n=50):
+    """Synthetic academic_marks / fee_payments style rows as MySQL returns them."""
+    rnd = random.Random(42)
+    base = date(2025, 6, 1)
+    rows = []
+    for i in range(n):
+        rows.append({
+            "student_id": 1000 + i,
+            "name": f"Student {i}",
+            "class": f"{rnd.randint(6, 12)}-{rnd.choice('ABCD')}",
+            "subject": rnd.choice(["Maths", "Science", "English", "Hindi", "Social"]),
+            "marks_obtained": Decimal(f"{rnd.uniform(20, 100):.2f}"),
+            "max_marks": Decimal("100.00"),
+            "exam_date": base + timedelta(days=rnd.randint(0, 200)),
+            "amount_due": Decimal(f"{rnd.uniform(0, 25000):.2f}"),
+            "updated_at": datetime(2025, 11, 1, 9, 30) + timedelta(minutes=i),
+        })
+    return rows
+
+
+def timed(fn, iterations=ITERATIONS):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        out = fn()
+    return out, (time.perf_counter() - start) * 1e6 / iterations
+
+
+def main():
+    rows = make_rows()
+    legacy_payload = {"summary": "x" * 200, "results": rows, "sql": "SELECT ..."}
+    columnar_payload = {"summary": "x" * 200, "results": to_columnar(rows), "sql": "SELECT ..."}
+
+    cases = [
+        ("records + json(default=str)", lambda: json.dumps(legacy_payload, default=str).encode()),
+        ("records + serialization.dumps", lambda: dumps(legacy_payload)),
+        ("columnar + serialization.dumps", lambda: dumps(columnar_payload)),
+    ]
+
+    print(f"encoder: {'orjson' if serialization.orjson else 'stdlib json'}, "
+          f"brotli: {'yes' if serialization.brotli else 'no'}")
+    print(f"{'case':34} {'bytes':>8} {'gzip':>8} {'br':>8} {'encode us':>10}")
+    for label, fn in cases:
+        body, us = timed(fn)
+        gz = len(gzip.compress(body, compresslevel=serialization.GZIP_LEVEL))
+        br = (
+            str(len(serialization.brotli.compress(body, quality=serialization.BROTLI_QUALITY)))
+            if serialization.brotli else "-"
+        )
+        print(f"{label:34} {len(body):>8} {gz:>8} {br:>8} {us:>10.1f}")
+
+    body = dumps(columnar_payload)
+    _, us = timed(lambda: serialization.compress(body, "gzip"), iterations=500)
+    print(f"\ngzip compress of columnar body: {us:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
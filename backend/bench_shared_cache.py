@@ -0,0 +1,71 @@
+"""
+Benchmark: cache hit rate with 1-8 worker processes.
+
+A fixed stream of Zipf-distributed chat questions is split round-robin across
+N worker processes (like uvicorn workers behind one socket). Each worker uses
+either a per-process MemoryCache or the TieredCache over a shared SQLite file.
+The "restart" column re-runs the tiered case on the same file, i.e. workers
+coming back after a deploy.
+
+Run from /backend:
+    python bench_shared_cache.py
+"""
+
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Pool
+
+from cache import MemoryCache, build_cache
+
+REQUESTS = 8000
+DISTINCT_QUESTIONS = 2000
+ZIPF_S = 1.1
+TTL = 3600
+
+
+def make_stream():
+    rnd = random.Random(7)
+    weights = [1.0 / (i ** ZIPF_S) for i in range(1, DISTINCT_QUESTIONS + 1)]
+    return [f"nl2sql:q{k}" for k in rnd.choices(range(DISTINCT_QUESTIONS), weights=weights, k=REQUESTS)]
+
+
+def run_worker(args):
+    kind, path, keys = args
+    cache = MemoryCache(4096) if kind == "memory" else build_cache("tiered", path)
+    start = time.perf_counter()
+    hits = 0
+    for key in keys:
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            cache.set(key, {"sql": "SELECT 1", "key": key}, TTL)
+    return hits, len(keys), time.perf_counter() - start
+
+
+def run(kind, workers, path, stream):
+    shards = [(kind, path, stream[i::workers]) for i in range(workers)]
+    with Pool(workers) as pool:
+        results = pool.map(run_worker, shards)
+    hits = sum(r[0] for r in results)
+    total = sum(r[1] for r in results)
+    us_per_op = max(r[2] for r in results) * 1e6 / max(total // workers, 1)
+    return hits * 100.0 / total, us_per_op
+
+
+def main():
+    stream = make_stream()
+    print(f"{REQUESTS} requests, {DISTINCT_QUESTIONS} distinct questions (zipf s={ZIPF_S})")
+    print(f"{'workers':>7} {'memory hit%':>12} {'tiered hit%':>12} {'restart hit%':>13} {'tiered us/op':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in (1, 2, 4, 8):
+            path = os.path.join(tmp, f"cache_{workers}.sqlite3")
+            mem_rate, _ = run("memory", workers, path, stream)
+            tiered_rate, us = run("tiered", workers, path, stream)
+            restart_rate, _ = run("tiered", workers, path, stream)
+            print(f"{workers:>7} {mem_rate:>12.1f} {tiered_rate:>12.1f} {restart_rate:>13.1f} {us:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Pluggable cache backends shared by the API.
+
+- MemoryCache: per-process LRU with TTL (fastest, but every uvicorn worker has
+  its own copy and it's empty after a restart).
+- SQLiteCache: one SQLite file (WAL mode) that every worker on the node reads
+  and writes. TTL plus entry / byte bounded eviction; survives restarts.
+- TieredCache: MemoryCache in front of a shared backend.
+
+Values must be JSON-serializable. Cache errors are logged and treated as misses;
+they never fail a request.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from serialization import dumps
+
+
+class CacheBackend(ABC):
+    """Interface every cache tier implements."""
+
+    name = "base"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "sets": self.sets,
+            "evictions": self.evictions,
+            "hit_rate_percent": round(self.hits * 100.0 / lookups, 2) if lookups else None,
+        }
+
+
+class MemoryCache(CacheBackend):
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024):
+        super().__init__()
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[1] < time.time():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (value, time.time() + ttl)
+            self._items.move_to_end(key)
+            self.sets += 1
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        s = super().stats()
+        s["entries"] = len(self._items)
+        return s
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Node-local cache in a SQLite file shared by all worker processes.
+
+    Eviction runs every `evict_every` writes: expired rows first, then the
+    least recently used rows until both max_entries and max_bytes hold.
+    """
+
+    name = "sqlite"
+
+    # Only bump accessed_at when it's older than this, so reads rarely write.
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path: str, max_entries: int = 50000, max_bytes: int = 256 * 1024 * 1024,
+                 evict_every: int = 200):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute("DELETE FROM cache WHERE key = ? AND expires_at < ?", (key, now))
+                self.misses += 1
+                return None
+            if now - row[2] > self.TOUCH_INTERVAL:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            print("Shared cache read error:", e)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        blob = dumps(value)
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, now + ttl, now, len(blob)),
+            )
+            self.sets += 1
+            self._writes += 1
+            if self._writes % self.evict_every == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            print("Shared cache write error:", e)
+
+    def evict(self):
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            removed = conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),)).rowcount
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                # drop LRU rows until under both bounds
+                over_entries = max(count - self.max_entries, 0)
+                cutoff_bytes = total - self.max_bytes
+                freed, n = 0, 0
+                for size, in conn.execute("SELECT size FROM cache ORDER BY accessed_at ASC"):
+                    if n >= over_entries and freed >= cutoff_bytes:
+                        break
+                    freed += size
+                    n += 1
+                if n:
+                    removed += conn.execute(
+                        "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at ASC LIMIT ?)",
+                        (n,),
+                    ).rowcount
+            conn.execute("COMMIT")
+            self.evictions += removed
+        except sqlite3.Error as e:
+            print("Shared cache eviction error:", e)
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+    def delete(self, key):
+        try:
+            self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print("Shared cache delete error:", e)
+
+    def clear(self):
+        try:
+            self._conn().execute("DELETE FROM cache")
+        except sqlite3.Error as e:
+            print("Shared cache clear error:", e)
+
+    def stats(self):
+        s = super().stats()
+        try:
+            count, total = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()
+            s.update(entries=count, bytes=total, path=self.path)
+        except sqlite3.Error:
+            pass
+        return s
+
+
+class TieredCache(CacheBackend):
+    """
+    Process-local MemoryCache in front of a shared backend. Shared hits are
+    copied into memory for at most `local_ttl` seconds to bound staleness.
+    """
+
+    name = "tiered"
+
+    def __init__(self, local: MemoryCache, shared: CacheBackend, local_ttl: float = 60.0):
+        super().__init__()
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        value = self.shared.get(key)
+        if value is not None:
+            self.local.set(key, value, self.local_ttl)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl):
+        self.local.set(key, value, min(ttl, self.local_ttl))
+        self.shared.set(key, value, ttl)
+        self.sets += 1
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        s = super().stats()
+        s["local"] = self.local.stats()
+        s["shared"] = self.shared.stats()
+        return s
+
+
+def build_cache(kind: str, path: str, memory_entries: int = 1024, shared_entries: int = 50000,
+                shared_bytes: int = 256 * 1024 * 1024, local_ttl: float = 60.0) -> CacheBackend:
+    """kind: "memory", "sqlite" or "tiered". Falls back to memory if the file can't be opened."""
+    if kind == "memory":
+        return MemoryCache(memory_entries)
+    try:
+        shared = SQLiteCache(path, max_entries=shared_entries, max_bytes=shared_bytes)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Shared cache unavailable ({e}); using in-memory cache.")
+        return MemoryCache(memory_entries)
+    if kind == "sqlite":
+        return shared
+    return TieredCache(MemoryCache(memory_entries), shared, local_ttl=local_ttl)
@@ -0,0 +1,510 @@
+"""
+Offline index advisor for the SQL Gemini generates.
+
+Streams `chat_success` / `chat_db_error` events from kpi_events, pulls the SQL
+out of meta_json, extracts WHERE predicates, JOIN keys, ORDER BY / GROUP BY
+columns, and aggregates how often (and how slowly) each table/column is used.
+It then prints ranked CREATE INDEX recommendations with an estimated benefit,
+plus generated-column suggestions for LOWER(col) LIKE ... style searches.
+
+Sources (no live DB needed):
+    python index_advisor.py --dump kpi_dump.sql          # mysqldump output
+    python index_advisor.py --dump kpi_events.csv        # CSV / TSV with a header row
+    python index_advisor.py --dump kpi_events.jsonl      # one event object per line
+    python index_advisor.py --mysql                      # local MySQL from .env settings
+
+A mysqldump that also contains the school tables' CREATE TABLE statements lets the
+advisor resolve unqualified columns and skip indexes that already exist.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+EVENT_TYPES = ("chat_success", "chat_db_error")
+
+SQL_KEYWORDS = {
+    "select", "from", "where", "and", "or", "not", "on", "join", "inner", "left",
+    "right", "outer", "cross", "group", "order", "by", "limit", "having", "as",
+    "using", "union", "all", "distinct", "like", "in", "is", "null", "between",
+    "asc", "desc", "case", "when", "then", "else", "end", "exists", "true", "false",
+    "straight_join", "natural", "offset", "interval",
+}
+
+COLREF = r"(?:`?([A-Za-z_]\w*)`?\s*\.\s*)?`?([A-Za-z_]\w*)`?"
+STRLIT = r"'s\d+'"
+CLAUSE_END = r"(?=\b(?:group\s+by|order\s+by|limit|having|union|join|inner|left|right|cross)\b|$)"
+
+
+# -------------------------
+# Event sources
+# -------------------------
+def _split_mysql_values(text: str) -> Iterator[List[Optional[str]]]:
+    """Yield the tuples of a mysqldump `VALUES (...),(...);` payload."""
+    escapes = {"n": "\n", "r": "\r", "t": "\t", "0": "\0"}
+    i, n = 0, len(text)
+    while i < n:
+        if text[i] != "(":
+            i += 1
+            continue
+        i += 1
+        row: List[Optional[str]] = []
+        buf: List[str] = []
+        quoted = was_quoted = False
+        while i < n:
+            ch = text[i]
+            if quoted:
+                if ch == "\\" and i + 1 < n:
+                    buf.append(escapes.get(text[i + 1], text[i + 1]))
+                    i += 2
+                    continue
+                if ch == "'":
+                    if i + 1 < n and text[i + 1] == "'":
+                        buf.append("'")
+                        i += 2
+                        continue
+                    quoted = False
+                else:
+                    buf.append(ch)
+            elif ch == "'":
+                quoted = was_quoted = True
+            elif ch in ",)":
+                val = "".join(buf)
+                if not was_quoted:
+                    val = val.strip()
+                    row.append(None if val.upper() == "NULL" else val)
+                else:
+                    row.append(val)
+                buf, was_quoted = [], False
+                if ch == ")":
+                    i += 1
+                    break
+            else:
+                buf.append(ch)
+            i += 1
+        yield row
+
+
+def read_dump_schema(path: str, schema: Dict[str, List[str]], indexes: Dict[str, List[Tuple[str, ...]]]):
+    """Collect column names and existing index keys from the CREATE TABLE blocks of a dump."""
+    current_table = None
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            if line.startswith("INSERT"):
+                continue
+            m = re.match(r"CREATE TABLE `?(\w+)`?", line, re.I)
+            if m:
+                current_table = m.group(1).lower()
+                schema[current_table] = []
+                continue
+            if not current_table:
+                continue
+            stripped = line.strip()
+            if stripped.startswith(")"):
+                current_table = None
+                continue
+            col = re.match(r"`(\w+)`\s+\w+", stripped)
+            if col:
+                schema[current_table].append(col.group(1))
+                continue
+            key = re.match(r"(?:PRIMARY |UNIQUE )?KEY\s*(?:`\w+`\s*)?\(([^)]*)\)", stripped, re.I)
+            if key:
+                cols = tuple(c.strip(" `").split("(")[0].lower() for c in key.group(1).split(","))
+                indexes[current_table].append(cols)
+
+
+def read_sql_dump(path: str, schema: Dict[str, List[str]], indexes: Dict[str, List[Tuple[str, ...]]]) -> Iterator[dict]:
+    """
+    Stream kpi_events rows out of a mysqldump file. The CREATE TABLE blocks are read
+    in a first pass because mysqldump writes tables alphabetically, so several school
+    tables come after kpi_events.
+    """
+    read_dump_schema(path, schema, indexes)
+    insert_re = re.compile(r"INSERT INTO `?kpi_events`?\s*(\(([^)]*)\))?\s*VALUES\s*", re.I)
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            m = insert_re.match(line)
+            if not m:
+                continue
+            columns = (
+                [c.strip(" `") for c in m.group(2).split(",")]
+                if m.group(2)
+                else schema.get("kpi_events", [])
+            )
+            for values in _split_mysql_values(line[m.end():]):
+                yield dict(zip(columns, values))
+
+
+def read_events(path: str, schema, indexes) -> Iterator[dict]:
+    lower = path.lower()
+    if lower.endswith(".sql"):
+        yield from read_sql_dump(path, schema, indexes)
+    elif lower.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8", newline="") as fh:
+            dialect = csv.excel_tab if lower.endswith(".tsv") else csv.excel
+            yield from csv.DictReader(fh, dialect=dialect)
+
+
+def read_mysql(schema, indexes) -> Iterator[dict]:
+    """Stream events from MySQL (.env settings) with an unbuffered cursor."""
+    from dotenv import load_dotenv
+    import mysql.connector
+
+    load_dotenv()
+    conn = mysql.connector.connect(
+        host=os.environ.get("MYSQL_HOST", "127.0.0.1"),
+        user=os.environ.get("MYSQL_USER"),
+        password=os.environ.get("MYSQL_PASSWORD"),
+        database=os.environ.get("MYSQL_DB"),
+        port=int(os.environ.get("MYSQL_PORT", 3306)),
+    )
+    try:
+        meta = conn.cursor()
+        meta.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, ORDINAL_POSITION"
+        )
+        for table, column in meta.fetchall():
+            schema.setdefault(table.lower(), []).append(column)
+        meta.execute(
+            "SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+        )
+        grouped = defaultdict(list)
+        for table, index_name, column in meta.fetchall():
+            grouped[(table.lower(), index_name)].append(column.lower())
+        for (table, _), cols in grouped.items():
+            indexes[table].append(tuple(cols))
+        meta.close()
+
+        cur = conn.cursor(dictionary=True, buffered=False)
+        cur.execute(
+            "SELECT event_type, latency_ms, meta_json FROM kpi_events WHERE event_type IN (%s, %s)",
+            EVENT_TYPES,
+        )
+        for row in cur:
+            yield row
+        cur.close()
+    finally:
+        conn.close()
+
+
+# -------------------------
+# SQL feature extraction
+# -------------------------
+def _mask_literals(sql: str) -> Tuple[str, List[str]]:
+    """Replace string literals with 'S<n>' so column regexes never match inside them."""
+    literals: List[str] = []
+
+    def sub(m):
+        literals.append(m.group(0)[1:-1])
+        return f"'s{len(literals) - 1}'"
+
+    return re.sub(r"'(?:[^'\\]|\\.|'')*'", sub, sql), literals
+
+
+class QueryFeatures:
+    def __init__(self):
+        self.tables: Set[str] = set()
+        # (table, column) -> set of kinds: eq, in, range, like_prefix, like_contains,
+        # func_like, func_eq, join, order, group
+        self.columns: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+
+
+def analyze_sql(sql: str, schema: Dict[str, List[str]]) -> QueryFeatures:
+    feats = QueryFeatures()
+    text, literals = _mask_literals(re.sub(r"(--[^\n]*|/\*.*?\*/)", " ", sql, flags=re.S))
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    known = {t: {c.lower() for c in cols} for t, cols in schema.items()}
+
+    aliases: Dict[str, str] = {}
+    for m in re.finditer(r"\b(?:from|join)\s+`?(\w+)`?(?:\s+(?:as\s+)?`?(\w+)`?)?", text):
+        table, alias = m.group(1), m.group(2)
+        if table == "select" or "(" in m.group(0):
+            continue
+        feats.tables.add(table)
+        aliases[table] = table
+        if alias and alias not in SQL_KEYWORDS:
+            aliases[alias] = table
+
+    def resolve(qual: Optional[str], col: str) -> List[str]:
+        if col in SQL_KEYWORDS or re.fullmatch(r"s\d+", col):
+            return []
+        if qual:
+            table = aliases.get(qual)
+            return [table] if table else []
+        owners = [t for t in feats.tables if col in known.get(t, ())]
+        if owners:
+            return owners
+        if len(feats.tables) == 1 and not known.get(next(iter(feats.tables))):
+            return list(feats.tables)
+        return []
+
+    def mark(qual, col, kind):
+        for table in resolve(qual, col):
+            feats.columns[(table, col)].add(kind)
+
+    # --- JOIN ... ON a.x = b.y / USING (x)
+    for m in re.finditer(r"\bon\s+(.+?)(?=\b(?:join|inner|left|right|cross|where|group|order|limit|having)\b|$)", text):
+        for a in re.finditer(COLREF + r"\s*=\s*" + COLREF, m.group(1)):
+            mark(a.group(1), a.group(2), "join")
+            mark(a.group(3), a.group(4), "join")
+    for m in re.finditer(r"\busing\s*\(([^)]*)\)", text):
+        for col in m.group(1).split(","):
+            col = col.strip(" `")
+            for table in feats.tables:
+                if col in known.get(table, {col}):
+                    feats.columns[(table, col)].add("join")
+
+    # --- WHERE predicates
+    for m in re.finditer(r"\bwhere\s+(.+?)" + CLAUSE_END, text):
+        where = m.group(1)
+        for p in re.finditer(r"\b(?:lower|upper)\s*\(\s*" + COLREF + r"\s*\)\s*(?:not\s+)?(like|=)\s*(" + STRLIT + ")?", where):
+            mark(p.group(1), p.group(2), "func_like" if p.group(3) == "like" else "func_eq")
+            if p.group(3) == "like" and p.group(4):
+                idx = int(p.group(4)[2:-1])
+                if idx < len(literals) and literals[idx].startswith("%"):
+                    mark(p.group(1), p.group(2), "like_contains")
+        for p in re.finditer(r"(?<![\w.(`'])" + COLREF + r"\s+(?:not\s+)?like\s+(" + STRLIT + ")", where):
+            idx = int(p.group(3)[2:-1])
+            pattern = literals[idx] if idx < len(literals) else ""
+            mark(p.group(1), p.group(2), "like_contains" if pattern.startswith("%") else "like_prefix")
+        for p in re.finditer(r"(?<![\w.(`'])" + COLREF + r"\s*(=|<=>)\s*(" + STRLIT + r"|-?\d[\w.]*|" + COLREF + r")", where):
+            rhs_qual, rhs_col = p.group(5), p.group(6)
+            if rhs_col and not re.fullmatch(r"\d.*", rhs_col) and rhs_col not in SQL_KEYWORDS:
+                mark(p.group(1), p.group(2), "join")
+                mark(rhs_qual, rhs_col, "join")
+            else:
+                mark(p.group(1), p.group(2), "eq")
+        for p in re.finditer(r"(?<![\w.(`'])" + COLREF + r"\s*(?:<=|>=|<>|!=|<|>)", where):
+            mark(p.group(1), p.group(2), "range")
+        for p in re.finditer(r"(?<![\w.(`'])" + COLREF + r"\s+(?:not\s+)?in\s*\(", where):
+            mark(p.group(1), p.group(2), "in")
+        for p in re.finditer(r"(?<![\w.(`'])" + COLREF + r"\s+(?:not\s+)?between\b", where):
+            mark(p.group(1), p.group(2), "range")
+
+    # --- ORDER BY / GROUP BY
+    for kind, kw in (("order", "order"), ("group", "group")):
+        for m in re.finditer(r"\b" + kw + r"\s+by\s+(.+?)(?=\b(?:limit|having|order|union)\b|\)|$)", text):
+            for part in m.group(1).split(","):
+                ref = re.fullmatch(r"\s*" + COLREF + r"(?:\s+(?:asc|desc))?\s*", part)
+                if ref:
+                    mark(ref.group(1), ref.group(2), kind)
+
+    return feats
+
+
+# -------------------------
+# Aggregation + recommendations
+# -------------------------
+class Workload:
+    def __init__(self, schema):
+        self.schema = schema
+        self.queries = 0
+        self.errors = 0
+        self.unparsed = 0
+        self.total_latency = 0
+        # (table, column) -> Counter(kind -> count)
+        self.column_kinds: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self.column_latency: Counter = Counter()
+        # (table, index column tuple) -> [query count, latency ms]
+        self.candidates: Dict[Tuple[str, Tuple[str, ...]], List[int]] = defaultdict(lambda: [0, 0])
+
+    def add(self, event: dict):
+        try:
+            meta = json.loads(event.get("meta_json") or "{}")
+        except (TypeError, ValueError):
+            self.unparsed += 1
+            return
+        sql = meta.get("sql")
+        if not sql:
+            return
+        latency = int(float(event.get("latency_ms") or 0))
+        self.queries += 1
+        self.total_latency += latency
+        if event.get("event_type") == "chat_db_error":
+            self.errors += 1
+
+        feats = analyze_sql(sql, self.schema)
+        per_table = defaultdict(dict)
+        for (table, col), kinds in feats.columns.items():
+            per_table[table][col] = kinds
+            for k in kinds:
+                self.column_kinds[(table, col)][k] += 1
+            self.column_latency[(table, col)] += latency
+
+        for table, cols in per_table.items():
+            # LOWER(col) = / LIKE can't use a key on `col`; those columns get a
+            # generated-column suggestion from case_insensitive_suggestions() instead
+            eq = sorted(c for c, k in cols.items() if k & {"eq", "in", "join"})
+            rng = sorted(c for c, k in cols.items() if k & {"range", "like_prefix"} and c not in eq)
+            order = sorted(c for c, k in cols.items() if k & {"order", "group"} and c not in eq and c not in rng)
+            key = tuple(eq) + tuple(rng[:1] or order[:1])
+            if key:
+                entry = self.candidates[(table, key)]
+                entry[0] += 1
+                entry[1] += latency
+
+    def recommend(self, indexes: Dict[str, List[Tuple[str, ...]]], top: int) -> List[dict]:
+        # Order equality columns by how often they are used so the leading column is the most selective-by-usage.
+        freq = {k: sum(v.values()) for k, v in self.column_kinds.items()}
+        scored: Dict[Tuple[str, Tuple[str, ...]], List[int]] = defaultdict(lambda: [0, 0])
+        for (table, cols), (count, latency) in self.candidates.items():
+            eq = [c for c in cols if self.column_kinds[(table, c)].keys() & {"eq", "in", "join"}]
+            tail = [c for c in cols if c not in eq]
+            eq.sort(key=lambda c: -freq.get((table, c), 0))
+            ordered = tuple(eq + tail)[:3]
+            # every prefix of the composite also serves the query
+            for n in range(1, len(ordered) + 1):
+                s = scored[(table, ordered[:n])]
+                s[0] += count
+                s[1] += latency * n // len(ordered)
+
+        recs = []
+        for (table, cols), (count, latency) in sorted(scored.items(), key=lambda kv: (-kv[1][1], -kv[1][0])):
+            if any(existing[: len(cols)] == cols for existing in indexes.get(table, [])):
+                continue
+            if any(r["table"] == table and r["columns"][: len(cols)] == list(cols) for r in recs):
+                continue
+            recs.append({
+                "table": table,
+                "columns": list(cols),
+                "queries": count,
+                "workload_share_percent": round(count * 100.0 / self.queries, 1) if self.queries else 0.0,
+                "latency_ms_covered": latency,
+                "latency_share_percent": round(latency * 100.0 / self.total_latency, 1) if self.total_latency else 0.0,
+                "ddl": "CREATE INDEX idx_{t}_{c} ON `{t}` ({cols});".format(
+                    t=table, c="_".join(cols), cols=", ".join(f"`{c}`" for c in cols)
+                ),
+            })
+            if len(recs) >= top:
+                break
+        return recs
+
+    def case_insensitive_suggestions(self) -> List[dict]:
+        out = []
+        for (table, col), kinds in sorted(self.column_kinds.items(), key=lambda kv: -self.column_latency[kv[0]]):
+            func = kinds["func_like"] + kinds["func_eq"]
+            contains = kinds["like_contains"]
+            if not func and not contains:
+                continue
+            ddl = [
+                f"ALTER TABLE `{table}` ADD COLUMN `{col}_lc` VARCHAR(255) "
+                f"GENERATED ALWAYS AS (LOWER(`{col}`)) STORED, ADD INDEX idx_{table}_{col}_lc (`{col}_lc`);"
+            ]
+            notes = []
+            if func:
+                notes.append("LOWER() hides the column from indexes; query the generated column (or rely on a _ci collation).")
+            if contains:
+                ddl.append(f"ALTER TABLE `{table}` ADD FULLTEXT INDEX ft_{table}_{col} (`{col}`);")
+                notes.append("Leading-% LIKE can't use a B-tree; FULLTEXT (ngram parser for short names) can.")
+            note = " ".join(notes)
+            out.append({
+                "table": table,
+                "column": col,
+                "lower_wrapped_predicates": func,
+                "leading_wildcard_likes": contains,
+                "latency_ms": self.column_latency[(table, col)],
+                "note": note,
+                "ddl": ddl,
+            })
+        return out
+
+    def column_report(self, limit: int = 20) -> List[dict]:
+        rows = []
+        for (table, col), kinds in sorted(self.column_kinds.items(), key=lambda kv: -self.column_latency[kv[0]])[:limit]:
+            uses = sum(kinds.values())
+            rows.append({
+                "table": table,
+                "column": col,
+                "uses": uses,
+                "kinds": dict(kinds),
+                "latency_ms": self.column_latency[(table, col)],
+            })
+        return rows
+
+
+def print_report(workload: Workload, recs, ci, columns):
+    print(f"Analyzed {workload.queries} queries ({workload.errors} db errors, "
+          f"{workload.unparsed} unparsable meta_json), total latency {workload.total_latency} ms\n")
+
+    print("Hot columns")
+    print(f"  {'table.column':40} {'uses':>6} {'latency ms':>11}  kinds")
+    for r in columns:
+        kinds = ", ".join(f"{k}={v}" for k, v in sorted(r["kinds"].items()))
+        print(f"  {r['table'] + '.' + r['column']:40} {r['uses']:>6} {r['latency_ms']:>11}  {kinds}")
+
+    print("\nIndex recommendations (ranked by latency of the queries they serve)")
+    for i, r in enumerate(recs, 1):
+        print(f"  {i}. {r['ddl']}")
+        print(f"     serves {r['queries']} queries ({r['workload_share_percent']}% of workload), "
+              f"{r['latency_ms_covered']} ms ({r['latency_share_percent']}% of latency)")
+    if not recs:
+        print("  (none - existing indexes already cover the observed predicates)")
+
+    print("\nCase-insensitive search suggestions")
+    for r in ci:
+        print(f"  {r['table']}.{r['column']}: {r['lower_wrapped_predicates']} LOWER() predicates, "
+              f"{r['leading_wildcard_likes']} leading-% LIKEs, {r['latency_ms']} ms")
+        print(f"     {r['note']}")
+        for ddl in r["ddl"]:
+            print(f"     {ddl}")
+    if not ci:
+        print("  (none)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommend MySQL indexes from chat SQL in kpi_events.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dump", help="kpi_events dump (.sql mysqldump, .csv/.tsv, .jsonl)")
+    source.add_argument("--mysql", action="store_true", help="read from MySQL using .env settings")
+    parser.add_argument("--schema", help="optional mysqldump --no-data file with the school tables")
+    parser.add_argument("--top", type=int, default=10, help="number of index recommendations")
+    parser.add_argument("--json", action="store_true", help="emit JSON instead of a text report")
+    args = parser.parse_args(argv)
+
+    schema: Dict[str, List[str]] = {}
+    indexes: Dict[str, List[Tuple[str, ...]]] = defaultdict(list)
+    if args.schema:
+        read_dump_schema(args.schema, schema, indexes)
+
+    workload = Workload(schema)
+    events = read_mysql(schema, indexes) if args.mysql else read_events(args.dump, schema, indexes)
+    for event in events:
+        if event.get("event_type") in EVENT_TYPES:
+            workload.add(event)
+
+    recs = workload.recommend(indexes, args.top)
+    ci = workload.case_insensitive_suggestions()
+    columns = workload.column_report()
+
+    if args.json:
+        json.dump(
+            {
+                "queries": workload.queries,
+                "db_errors": workload.errors,
+                "total_latency_ms": workload.total_latency,
+                "columns": columns,
+                "indexes": recs,
+                "case_insensitive": ci,
+            },
+            sys.stdout,
+            indent=2,
+        )
+        print()
+    else:
+        print_report(workload, recs, ci, columns)
+
+
+if __name__ == "__main__":
+    main()
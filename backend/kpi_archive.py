@@ -0,0 +1,396 @@
+"""
+Retention and archival for the kpi_events table.
+
+- KpiArchive.archive(): moves events older than the retention window into
+  gzip-compressed, column-oriented files partitioned by day
+  (<archive_dir>/date=YYYY-MM-DD/part-<first_id>-<last_id>.json.gz), then
+  deletes those rows from MySQL in batches. Each day also gets a small rollup
+  (counts / latency per event_type, role and teacher) kept in _manifest.json.
+- KpiEventStore: the query facade used by the KPI endpoints. It merges the
+  archive rollups with a GROUP BY over the (now small) live table, so
+  dashboards keep their full history without scanning every event.
+
+CLI (run from /backend, e.g. nightly from cron):
+    python kpi_archive.py archive --days 90 --batch 5000
+    python kpi_archive.py report
+
+The archive job range-scans on ts; add `CREATE INDEX idx_kpi_events_ts ON kpi_events (ts)`
+if the table doesn't have it.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from serialization import dumps
+
+KPI_COLUMNS = ["id", "ts", "user_id", "role", "event_type", "success", "latency_ms", "meta_json"]
+CHAT_ERROR_EVENTS = ("chat_error", "chat_ai_error", "chat_db_error")
+
+
+def _day(value) -> str:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)[:10]
+
+
+def _rollup_key(event_type: str, role: Optional[str], user_id: Optional[int]) -> str:
+    # user ids are only kept for teachers (top-teacher chart); students would blow up the rollup
+    uid = user_id if role == "teacher" and user_id is not None else ""
+    return f"{event_type}|{role or ''}|{uid}"
+
+
+def _parse_rollup_key(key: str):
+    event_type, role, uid = key.split("|")
+    return event_type, role or None, int(uid) if uid else None
+
+
+# -------------------------
+# Archive
+# -------------------------
+class KpiArchive:
+    def __init__(self, root: str):
+        self.root = root
+        self._manifest_path = os.path.join(root, "_manifest.json")
+        self._cache = None
+        self._cache_mtime = None
+        self._lock = threading.Lock()
+
+    # ---- manifest ----
+    def manifest(self) -> Dict[str, Any]:
+        """Manifest (cached until the file changes)."""
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self._manifest_path)
+            except OSError:
+                return {"max_id": 0, "days": {}}
+            if self._cache is None or mtime != self._cache_mtime:
+                with open(self._manifest_path, encoding="utf-8") as fh:
+                    self._cache = json.load(fh)
+                self._cache_mtime = mtime
+            return self._cache
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._manifest_path + ".tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(dumps(manifest))
+        os.replace(tmp, self._manifest_path)
+
+    # ---- writing ----
+    def _write_part(self, day: str, rows: List[tuple]) -> Dict[str, Any]:
+        """Write one column-oriented gzip part for a day; returns its manifest entry."""
+        columns = [[r[i] for r in rows] for i in range(len(KPI_COLUMNS))]
+        raw = dumps({"columns": KPI_COLUMNS, "data": columns})
+        first_id, last_id = rows[0][0], rows[-1][0]
+        directory = os.path.join(self.root, f"date={day}")
+        os.makedirs(directory, exist_ok=True)
+        name = f"part-{first_id}-{last_id}.json.gz"
+        tmp = os.path.join(directory, name + ".tmp")
+        with gzip.open(tmp, "wb", compresslevel=9) as fh:
+            fh.write(raw)
+        os.replace(tmp, os.path.join(directory, name))
+        return {
+            "file": f"date={day}/{name}",
+            "first_id": first_id,
+            "last_id": last_id,
+            "rows": len(rows),
+            "raw_bytes": len(raw),
+            "compressed_bytes": os.path.getsize(os.path.join(directory, name)),
+        }
+
+    def archive(self, connect: Callable, retention_days: int, batch_size: int = 5000,
+                pause_seconds: float = 0.0) -> Dict[str, Any]:
+        """
+        Archive + delete events older than `retention_days` (whole days), batch by batch.
+        Safe to re-run after a crash: rows already covered by a part are only deleted.
+        """
+        cutoff = datetime.combine(date.today() - timedelta(days=retention_days), datetime.min.time())
+        manifest = json.loads(json.dumps(self.manifest()))
+        summary = {"cutoff": cutoff.isoformat(), "archived": 0, "deleted": 0, "batches": 0}
+        start = time.perf_counter()
+
+        conn = connect()
+        try:
+            cur = conn.cursor()
+            last_id = 0
+            while True:
+                cur.execute(
+                    f"SELECT {', '.join(KPI_COLUMNS)} FROM kpi_events "
+                    "WHERE ts < %s AND id > %s ORDER BY id LIMIT %s",
+                    (cutoff, last_id, batch_size),
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                by_day = defaultdict(list)
+                for r in rows:
+                    day = _day(r[1])
+                    parts = manifest["days"].get(day, {}).get("parts", [])
+                    if any(p["first_id"] <= r[0] <= p["last_id"] for p in parts):
+                        continue  # archived by an earlier (interrupted) run
+                    by_day[day].append(
+                        (r[0], r[1].isoformat(sep=" ") if isinstance(r[1], datetime) else r[1], *r[2:])
+                    )
+
+                for day, day_rows in by_day.items():
+                    entry = manifest["days"].setdefault(day, {"parts": [], "rollup": {}})
+                    entry["parts"].append(self._write_part(day, day_rows))
+                    rollup = entry["rollup"]
+                    for r in day_rows:
+                        key = _rollup_key(r[4], r[3], r[2])
+                        agg = rollup.setdefault(key, [0, 0, 0])
+                        agg[0] += 1
+                        if r[6] is not None:
+                            agg[1] += int(r[6])
+                            agg[2] += 1
+                    summary["archived"] += len(day_rows)
+
+                manifest["max_id"] = max(manifest.get("max_id", 0), last_id)
+                # Manifest first, then delete: a crash in between only leaves rows to re-delete.
+                self._write_manifest(manifest)
+
+                ids = [r[0] for r in rows]
+                cur.execute(
+                    f"DELETE FROM kpi_events WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+                )
+                conn.commit()
+                summary["deleted"] += cur.rowcount
+                summary["batches"] += 1
+                if pause_seconds:
+                    time.sleep(pause_seconds)
+            cur.close()
+        finally:
+            conn.close()
+
+        summary["seconds"] = round(time.perf_counter() - start, 2)
+        return summary
+
+    # ---- reading ----
+    def iter_rows(self, day_from: Optional[str] = None, day_to: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream archived events (as dicts) for an inclusive day range."""
+        for day in sorted(self.manifest()["days"]):
+            if (day_from and day < day_from) or (day_to and day > day_to):
+                continue
+            for part in self.manifest()["days"][day]["parts"]:
+                with gzip.open(os.path.join(self.root, part["file"]), "rb") as fh:
+                    payload = json.loads(fh.read())
+                columns, data = payload["columns"], payload["data"]
+                for values in zip(*data):
+                    yield dict(zip(columns, values))
+
+    def rollup_rows(self) -> List[Dict[str, Any]]:
+        out = []
+        for day, entry in self.manifest()["days"].items():
+            for key, (count, lat_sum, lat_n) in entry["rollup"].items():
+                event_type, role, user_id = _parse_rollup_key(key)
+                out.append({
+                    "day": day, "event_type": event_type, "role": role, "user_id": user_id,
+                    "count": count, "latency_sum": lat_sum, "latency_n": lat_n,
+                })
+        return out
+
+    def report(self) -> Dict[str, Any]:
+        manifest = self.manifest()
+        parts = [p for d in manifest["days"].values() for p in d["parts"]]
+        raw = sum(p["raw_bytes"] for p in parts)
+        compressed = sum(p["compressed_bytes"] for p in parts)
+        return {
+            "root": self.root,
+            "days": len(manifest["days"]),
+            "first_day": min(manifest["days"]) if manifest["days"] else None,
+            "last_day": max(manifest["days"]) if manifest["days"] else None,
+            "parts": len(parts),
+            "rows": sum(p["rows"] for p in parts),
+            "raw_bytes": raw,
+            "compressed_bytes": compressed,
+            "compression_ratio": round(raw / compressed, 2) if compressed else None,
+            "max_archived_id": manifest.get("max_id", 0),
+        }
+
+
+# -------------------------
+# Query facade
+# -------------------------
+class KpiEventStore:
+    """KPI aggregates over archive rollups + the live kpi_events table."""
+
+    def __init__(self, connect: Callable, archive: KpiArchive):
+        self.connect = connect
+        self.archive = archive
+
+    def rollup(self) -> List[Dict[str, Any]]:
+        rows = self.archive.rollup_rows()
+        max_id = self.archive.manifest().get("max_id", 0)
+        conn = self.connect()
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(
+                """
+                SELECT DATE(ts) AS day, event_type, role,
+                       CASE WHEN role = 'teacher' THEN user_id END AS user_id,
+                       COUNT(*) AS count,
+                       COALESCE(SUM(latency_ms), 0) AS latency_sum,
+                       COUNT(latency_ms) AS latency_n
+                FROM kpi_events
+                WHERE id > %s
+                GROUP BY DATE(ts), event_type, role, CASE WHEN role = 'teacher' THEN user_id END
+                """,
+                (max_id,),
+            )
+            for r in cur.fetchall():
+                r["day"] = _day(r["day"])
+                r["count"] = int(r["count"])
+                r["latency_sum"] = int(r["latency_sum"])
+                r["latency_n"] = int(r["latency_n"])
+                rows.append(r)
+            cur.close()
+        finally:
+            conn.close()
+        return rows
+
+    @staticmethod
+    def _per_day(rows, predicate) -> List[Dict[str, Any]]:
+        days = defaultdict(int)
+        for r in rows:
+            if predicate(r):
+                days[r["day"]] += r["count"]
+        return [{"day": d, "count": c} for d, c in sorted(days.items())]
+
+    def dashboard(self) -> Dict[str, Any]:
+        """Same shape the KPI dashboard has always consumed."""
+        rows = self.rollup()
+        chat = [r for r in rows if r["event_type"].startswith("chat_")]
+
+        def total(pred):
+            return sum(r["count"] for r in rows if pred(r))
+
+        lat_sum = sum(r["latency_sum"] for r in chat)
+        lat_n = sum(r["latency_n"] for r in chat)
+
+        teachers = defaultdict(int)
+        for r in chat:
+            if r["role"] == "teacher" and r["user_id"] is not None:
+                teachers[r["user_id"]] += r["count"]
+
+        return {
+            "stats": {
+                "total_queries": sum(r["count"] for r in chat),
+                "success_count": total(lambda r: r["event_type"] == "chat_success"),
+                "error_count": total(lambda r: r["event_type"] in CHAT_ERROR_EVENTS),
+                "login_success": total(lambda r: r["event_type"] == "login_success"),
+                "login_failed": total(lambda r: r["event_type"] == "login_failed"),
+                "avg_response_time": lat_sum / lat_n if lat_n else 0,
+            },
+            "usage_trend": self._per_day(chat, lambda r: True),
+            "teacher_usage": [
+                {"user_id": uid, "count": c}
+                for uid, c in sorted(teachers.items(), key=lambda kv: -kv[1])[:5]
+            ],
+            "student_login_trend": self._per_day(
+                rows, lambda r: r["role"] == "student" and r["event_type"] == "login_success"
+            ),
+            "uptime_trend": self._per_day(rows, lambda r: True),
+        }
+
+    def daily_usage(self) -> List[Dict[str, Any]]:
+        days = defaultdict(lambda: {"successful_chats": 0, "chat_errors": 0})
+        for r in self.rollup():
+            if not r["event_type"].startswith("chat_"):
+                continue
+            day = days[r["day"]]
+            if r["event_type"] == "chat_success":
+                day["successful_chats"] += r["count"]
+            elif r["event_type"] == "chat_error":
+                day["chat_errors"] += r["count"]
+        return [{"day": d, **v} for d, v in sorted(days.items())]
+
+
+# -------------------------
+# Reporting
+# -------------------------
+def table_report(connect: Callable) -> Dict[str, Any]:
+    """kpi_events size from information_schema plus the time of a full-table aggregate scan."""
+    conn = connect()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute(
+            """
+            SELECT TABLE_ROWS AS approx_rows, DATA_LENGTH AS data_bytes, INDEX_LENGTH AS index_bytes
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'kpi_events'
+            """
+        )
+        sizes = cur.fetchone() or {}
+        start = time.perf_counter()
+        cur.execute("SELECT COUNT(*) AS n, AVG(latency_ms) AS avg_latency FROM kpi_events")
+        scan = cur.fetchone() or {}
+        scan_ms = round((time.perf_counter() - start) * 1000, 2)
+        cur.close()
+    finally:
+        conn.close()
+    return {
+        "rows": int(scan.get("n") or 0),
+        "approx_rows": sizes.get("approx_rows"),
+        "data_bytes": sizes.get("data_bytes"),
+        "index_bytes": sizes.get("index_bytes"),
+        "full_scan_ms": scan_ms,
+    }
+
+
+def _connect_from_env():
+    from dotenv import load_dotenv
+    import mysql.connector
+
+    load_dotenv()
+    return mysql.connector.connect(
+        host=os.environ.get("MYSQL_HOST"),
+        user=os.environ.get("MYSQL_USER"),
+        password=os.environ.get("MYSQL_PASSWORD"),
+        database=os.environ.get("MYSQL_DB"),
+        port=int(os.environ.get("MYSQL_PORT", 3306)),
+    )
+
+
+def default_archive_dir() -> str:
+    return os.environ.get(
+        "KPI_ARCHIVE_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive", "kpi_events"),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="kpi_events retention / archival")
+    parser.add_argument("--dir", default=default_archive_dir(), help="archive directory")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    arc = sub.add_parser("archive", help="archive and delete old events")
+    arc.add_argument("--days", type=int, default=int(os.environ.get("KPI_RETENTION_DAYS", 90)))
+    arc.add_argument("--batch", type=int, default=5000)
+    arc.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    sub.add_parser("report", help="table size, scan time and archive compression")
+    args = parser.parse_args(argv)
+
+    archive = KpiArchive(args.dir)
+    if args.cmd == "archive":
+        before = table_report(_connect_from_env)
+        result = archive.archive(_connect_from_env, args.days, args.batch, args.pause)
+        after = table_report(_connect_from_env)
+        print(json.dumps({"job": result, "table_before": before, "table_after": after,
+                          "archive": archive.report()}, indent=2, default=str))
+    else:
+        print(json.dumps({"table": table_report(_connect_from_env), "archive": archive.report()},
+                         indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Startup / lifecycle helpers for the SchoolData API.
+
+Heavy dependencies (Gemini client, bcrypt context, schema introspection) are
+wrapped in LazyResource so importing main.py stays cheap. The FastAPI lifespan
+hook warms them in parallel (in the background by default, so a worker accepts
+connections immediately), and anything not warmed yet is built on first use.
+Each resource records its state and init time for the startup report.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+
+class LazyResource:
+    """
+    Thread-safe, build-once value.
+
+    factory: zero-arg callable; raising means "not available" and get() returns None.
+    retry_after: seconds before a failed build is attempted again (None = never retry).
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], retry_after: Optional[float] = None):
+        self.name = name
+        self.factory = factory
+        self.retry_after = retry_after
+        self.state = "pending"  # pending | initializing | ready | failed
+        self.init_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self._value = None
+        self._failed_at = 0.0
+        self._lock = threading.Lock()
+        self._warming = False
+        self._warm_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def get(self):
+        if self.state == "ready":
+            return self._value
+        with self._lock:
+            if self.state == "ready":
+                return self._value
+            if self.state == "failed" and (
+                self.retry_after is None or time.time() - self._failed_at < self.retry_after
+            ):
+                return None
+            self.state = "initializing"
+            self.attempts += 1
+            start = time.perf_counter()
+            try:
+                self._value = self.factory()
+                self.state = "ready"
+                self.error = None
+            except Exception as e:
+                self._value = None
+                self.state = "failed"
+                self.error = str(e)
+                self._failed_at = time.time()
+                print(f"❌ {self.name} init failed: {e}")
+            self.init_ms = round((time.perf_counter() - start) * 1000, 2)
+            return self._value
+
+    def warm_in_background(self):
+        """Run get() on a daemon thread unless it is ready or a build is already under way."""
+        # not self._lock: get() holds that for the whole build
+        with self._warm_lock:
+            if self.state in ("ready", "initializing") or self._warming:
+                return
+            self._warming = True
+
+        def run():
+            try:
+                self.get()
+            finally:
+                self._warming = False
+
+        threading.Thread(target=run, name=f"warm-{self.name}", daemon=True).start()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "init_ms": self.init_ms,
+            "attempts": self.attempts,
+            "error": self.error,
+        }
+
+
+class Lifecycle:
+    """Tracks resources, warms them in parallel and produces the startup report."""
+
+    def __init__(self, module_t0: float):
+        self.module_t0 = module_t0
+        self.imported_ms: Optional[float] = None
+        self.started_ms: Optional[float] = None
+        self.warmed_ms: Optional[float] = None
+        self.resources: List[LazyResource] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def register(self, resource: LazyResource) -> LazyResource:
+        self.resources.append(resource)
+        return resource
+
+    def mark_imported(self):
+        self.imported_ms = round((time.perf_counter() - self.module_t0) * 1000, 2)
+
+    def start(self, mode: str = "background"):
+        """
+        mode: "background" - warm resources in threads, don't block startup
+              "blocking"   - warm in parallel and wait before accepting traffic
+              "off"        - build everything lazily on first use
+        """
+        if mode != "off" and self.resources:
+            self._executor = ThreadPoolExecutor(
+                max_workers=len(self.resources), thread_name_prefix="warmup"
+            )
+            futures = [self._executor.submit(r.get) for r in self.resources]
+            warm_t0 = time.perf_counter()
+
+            def done(_):
+                if all(f.done() for f in futures):
+                    self.warmed_ms = round((time.perf_counter() - warm_t0) * 1000, 2)
+
+            for f in futures:
+                f.add_done_callback(done)
+            if mode == "blocking":
+                wait(futures)
+        self.started_ms = round((time.perf_counter() - self.module_t0) * 1000, 2)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "import_ms": self.imported_ms,
+            "startup_ms": self.started_ms,
+            "warmup_ms": self.warmed_ms,
+            "components": {r.name: r.status() for r in self.resources},
+        }
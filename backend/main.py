@@ -1,23 +1,37 @@
+import time
+_MODULE_T0 = time.perf_counter()
+
 from dotenv import load_dotenv
 load_dotenv()
 
 import os
 import re
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from typing import Optional, Dict, Set, List, Any
 from datetime import datetime, timedelta
 
+import anyio.to_thread
 import mysql.connector
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 
-# Gemini client
-from google import genai
-
 import json
-import time
+import hashlib
+import uuid
+
+from serialization import dumps, encode_json, to_columnar
+from profile_snapshot import ProfileSnapshotCache, SnapshotMiss
+from lifecycle import LazyResource, Lifecycle
+from cache import build_cache
+from scheduler import Scheduler, SchedulerRejected
+from export import EXPORT_FORMATS, stream_query
+from kpi_archive import KpiArchive, KpiEventStore, default_archive_dir, table_report
+from aggregates import AggregateManager, AggregateRefresher, mysql_named_lock
+from profiling import Profiler, active, annotate, span
 
 # -------------------------
 # Config
@@ -33,30 +47,136 @@ JWT_SECRET = os.environ.get("JWT_SECRET", "change_this_super_secret")
 JWT_ALGO = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 240))
 
+# Optional: prefetch a student's own rows at login and answer their queries in-process
+PROFILE_SNAPSHOT_ENABLED = os.environ.get("PROFILE_SNAPSHOT_ENABLED", "0").lower() in ("1", "true", "yes")
+PROFILE_SNAPSHOT_TTL_SECONDS = float(os.environ.get("PROFILE_SNAPSHOT_TTL_SECONDS", 300))
+PROFILE_SNAPSHOT_MAX_USERS = int(os.environ.get("PROFILE_SNAPSHOT_MAX_USERS", 500))
+
+# Startup warmup: "background" (default), "blocking" or "off" (everything lazy)
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "background").lower()
+# Seconds before retrying schema introspection after the DB was unreachable
+SCHEMA_RETRY_SECONDS = float(os.environ.get("SCHEMA_RETRY_SECONDS", 30))
+
+# Cache tiers: "memory" (per worker), "sqlite" (shared file) or "tiered" (memory + shared file)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "tiered").lower()
+CACHE_PATH = os.environ.get(
+    "CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "shared_cache.sqlite3")
+)
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 50000))
+CACHE_MAX_MB = int(os.environ.get("CACHE_MAX_MB", 256))
+NL2SQL_CACHE_TTL_SECONDS = float(os.environ.get("NL2SQL_CACHE_TTL_SECONDS", 3600))
+SCHEMA_CACHE_TTL_SECONDS = float(os.environ.get("SCHEMA_CACHE_TTL_SECONDS", 600))
+
+# Scheduler: concurrent Gemini calls / DB queries per worker, and max queue wait
+SCHED_LLM_SLOTS = int(os.environ.get("SCHED_LLM_SLOTS", 4))
+SCHED_DB_SLOTS = int(os.environ.get("SCHED_DB_SLOTS", 8))
+SCHED_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("SCHED_QUEUE_TIMEOUT_SECONDS", 20))
+# Concurrent full-result exports per worker (separate from the DB slots chat queries use)
+SCHED_EXPORT_SLOTS = int(os.environ.get("SCHED_EXPORT_SLOTS", 2))
+# Threads serving sync endpoints; the scheduler's per-class caps must fit well inside it
+SCHED_THREADPOOL_SIZE = int(os.environ.get("SCHED_THREADPOOL_SIZE", 40))
+
+# Chat responses carry at most this many rows; the full result is available via export
+CHAT_PREVIEW_ROWS = 50
+# How long a chat turn's SQL stays exportable, and rows per streamed chunk
+EXPORT_TURN_TTL_SECONDS = float(os.environ.get("EXPORT_TURN_TTL_SECONDS", 3600))
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 2000))
+
+# Optional: materialized class / attendance / fee summary tables for teacher queries
+AGGREGATES_ENABLED = os.environ.get("AGGREGATES_ENABLED", "0").lower() in ("1", "true", "yes")
+AGGREGATES_REFRESH_SECONDS = float(os.environ.get("AGGREGATES_REFRESH_SECONDS", 300))
+# Every Nth refresh rebuilds from scratch (picks up edits / deletes)
+AGGREGATES_FULL_REFRESH_EVERY = int(os.environ.get("AGGREGATES_FULL_REFRESH_EVERY", 12))
+
+# Per-request chat traces: % of chats sampled, secret for the X-Profile header (empty = header off),
+# traces kept per worker, and the flamegraph stack sampling period
+TRACE_SAMPLE_PERCENT = float(os.environ.get("TRACE_SAMPLE_PERCENT", 0))
+TRACE_TOKEN = os.environ.get("TRACE_TOKEN", "")
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", 200))
+TRACE_FLAME_INTERVAL_MS = float(os.environ.get("TRACE_FLAME_INTERVAL_MS", 5))
+
 # -------------------------
 # Init
 # -------------------------
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = HTTPBearer()
-
-app = FastAPI(title="SchoolData Chatbot API")
-
-# Init Gemini
-genai_client = None
-
 # FIX: Updated to "gemini-2.0-flash-exp" to fix 404 errors
 GENAI_MODEL = "models/gemini-flash-latest"
 
+oauth2_scheme = HTTPBearer()
 
-if GEMINI_API_KEY:
-    try:
-        genai_client = genai.Client(api_key=GEMINI_API_KEY)
-        print(f"✅ Gemini Client Connected. Using model: {GENAI_MODEL}")
-    except Exception as e:
-        genai_client = None
-        print(f"❌ Error initializing Gemini Client: {e}")
-else:
-    print("⚠️ Warning: GEMINI_API_KEY is missing in .env file.")
+
+def _init_genai_client():
+    if not GEMINI_API_KEY:
+        print("⚠️ Warning: GEMINI_API_KEY is missing in .env file.")
+        raise RuntimeError("GEMINI_API_KEY is missing")
+    from google import genai
+
+    client = genai.Client(api_key=GEMINI_API_KEY)
+    chat_helper.client = client
+    print(f"✅ Gemini Client Connected. Using model: {GENAI_MODEL}")
+    return client
+
+
+def _init_pwd_context():
+    from passlib.context import CryptContext
+
+    ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    # Force the bcrypt backend to load now rather than on the first login
+    ctx.hash("warmup")
+    return ctx
+
+
+shared_cache = build_cache(
+    CACHE_BACKEND,
+    CACHE_PATH,
+    shared_entries=CACHE_MAX_ENTRIES,
+    shared_bytes=CACHE_MAX_MB * 1024 * 1024,
+)
+
+lifecycle = Lifecycle(_MODULE_T0)
+genai_resource = lifecycle.register(LazyResource("gemini", _init_genai_client))
+pwd_resource = lifecycle.register(LazyResource("bcrypt", _init_pwd_context))
+schema_resource = lifecycle.register(
+    LazyResource("schema", lambda: load_allowed_columns(), retry_after=SCHEMA_RETRY_SECONDS)
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the scheduler's admission caps are sized against this pool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = SCHED_THREADPOOL_SIZE
+    lifecycle.start(STARTUP_WARMUP)
+    print(f"🚀 Startup in {lifecycle.started_ms} ms (warmup: {STARTUP_WARMUP})")
+    if aggregate_refresher:
+        aggregate_refresher.start()
+    yield
+    if aggregate_refresher:
+        aggregate_refresher.stop()
+    lifecycle.shutdown()
+
+
+app = FastAPI(title="SchoolData Chatbot API", lifespan=lifespan)
+
+# teacher chat > student chat > KPI analytics, with weighted fair sharing of LLM / DB slots
+scheduler = Scheduler(
+    SCHED_LLM_SLOTS, SCHED_DB_SLOTS, SCHED_QUEUE_TIMEOUT_SECONDS,
+    export_slots=SCHED_EXPORT_SLOTS, threadpool_size=SCHED_THREADPOOL_SIZE,
+)
+
+profiler = Profiler(
+    capacity=TRACE_BUFFER_SIZE,
+    sample_percent=TRACE_SAMPLE_PERCENT,
+    token=TRACE_TOKEN,
+    flame_interval_ms=TRACE_FLAME_INTERVAL_MS,
+)
+
+
+@app.exception_handler(SchedulerRejected)
+def scheduler_rejected_handler(request: Request, exc: SchedulerRejected):
+    return JSONResponse(
+        {"detail": exc.detail},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 def log_kpi_event(
     event_type: str,
@@ -82,37 +202,40 @@ def log_kpi_event(
         meta_json TEXT NULL
     );
     """
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+    annotate(event=event_type)
+    with span("kpi_write", event_type=event_type) as sp:
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
 
-        meta_json = json.dumps(meta or {}, ensure_ascii=False)
+            meta_json = json.dumps(meta or {}, ensure_ascii=False)
+            sp["meta_bytes"] = len(meta_json)
 
-        cur.execute(
-            """
-            INSERT INTO kpi_events
-            (ts, user_id, role, event_type, success, latency_ms, meta_json)
-            VALUES (NOW(), %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                int(user_id) if user_id is not None else None,
-                role,
-                event_type,
-                1 if success else 0,
-                int(latency_ms) if latency_ms is not None else None,
-                meta_json,
-            ),
-        )
-        conn.commit()
-    except Exception as e:
-        # Don't crash the app because of KPI logging
-        print("KPI log error:", e)
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except:
-            pass
+            cur.execute(
+                """
+                INSERT INTO kpi_events
+                (ts, user_id, role, event_type, success, latency_ms, meta_json)
+                VALUES (NOW(), %s, %s, %s, %s, %s, %s)
+                """,
+                (
+                    int(user_id) if user_id is not None else None,
+                    role,
+                    event_type,
+                    1 if success else 0,
+                    int(latency_ms) if latency_ms is not None else None,
+                    meta_json,
+                ),
+            )
+            conn.commit()
+        except Exception as e:
+            # Don't crash the app because of KPI logging
+            print("KPI log error:", e)
+        finally:
+            try:
+                cur.close()
+                conn.close()
+            except:
+                pass
 
 
 # -------------------------
@@ -130,29 +253,82 @@ ALLOWED_TABLES = [
 ]
 ALLOWED_TABLES_WITH_TEACHERS = ALLOWED_TABLES + ["teachers"]
 
+# KPI reads go through the facade: archived day rollups + live kpi_events
+kpi_archive = KpiArchive(default_archive_dir())
+kpi_store = KpiEventStore(get_db_connection, kpi_archive)
+
 def introspect_allowed_columns() -> Dict[str, list]:
+    """
+    Raises if the DB is unreachable (or drops mid-way) so the schema resource
+    retries later; only a table that doesn't exist is recorded as [].
+    """
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cur = conn.cursor()
         allowed = {}
         for t in ALLOWED_TABLES_WITH_TEACHERS:
             try:
                 cur.execute(f"DESCRIBE `{t}`;")
                 allowed[t] = [r[0] for r in cur.fetchall()]
-            except:
+            except mysql.connector.Error as e:
+                if e.errno != 1146:  # ER_NO_SUCH_TABLE
+                    raise
                 allowed[t] = []
-        conn.close()
         return allowed
-    except Exception as e:
-        print("DB Introspection failed:", e)
-        return {t: [] for t in ALLOWED_TABLES_WITH_TEACHERS}
+    finally:
+        conn.close()
 
-ALLOWED_COLUMNS = introspect_allowed_columns()
+def load_allowed_columns() -> Dict[str, list]:
+    """Schema from the shared cache when another worker already introspected it."""
+    cached = shared_cache.get("schema:allowed_columns")
+    if cached:
+        return cached
+    allowed = introspect_allowed_columns()
+    shared_cache.set("schema:allowed_columns", allowed, SCHEMA_CACHE_TTL_SECONDS)
+    return allowed
+
+def get_allowed_columns() -> Dict[str, list]:
+    return schema_resource.get() or {t: [] for t in ALLOWED_TABLES_WITH_TEACHERS}
+
+@contextmanager
+def _aggregate_refresh_guard():
+    """One worker refreshes at a time, and only while holding a (KPI class) DB slot."""
+    with mysql_named_lock(get_db_connection, f"{MYSQL_DB}:aggregates") as leader:
+        if not leader:
+            yield False
+            return
+        with scheduler.slot("db", "kpi"):
+            yield True
+
+aggregates = AggregateManager(get_db_connection, get_allowed_columns) if AGGREGATES_ENABLED else None
+aggregate_refresher = (
+    AggregateRefresher(
+        aggregates,
+        AGGREGATES_REFRESH_SECONDS,
+        AGGREGATES_FULL_REFRESH_EVERY,
+        guard=_aggregate_refresh_guard,
+    )
+    if aggregates
+    else None
+)
+
+profile_cache = (
+    ProfileSnapshotCache(
+        get_db_connection,
+        max_users=PROFILE_SNAPSHOT_MAX_USERS,
+        ttl_seconds=PROFILE_SNAPSHOT_TTL_SECONDS,
+    )
+    if PROFILE_SNAPSHOT_ENABLED
+    else None
+)
 
 # -------------------------
 # Auth Logic
 # -------------------------
 def verify_password(plain: str, hashed: str) -> bool:
+    pwd_context = pwd_resource.get()
+    if pwd_context is None:
+        raise HTTPException(status_code=503, detail="Password hashing unavailable")
     return pwd_context.verify(plain, hashed)
 
 def create_access_token(data: dict):
@@ -177,9 +353,28 @@ class TokenResponse(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    # "columnar" -> results = {"columns": [...], "rows": [[...]]}
+    # "records"  -> results = [{...}, ...] (legacy shape)
+    format: str = "columnar"
+    # "trace" or "flame": profile this request (teachers only)
+    profile: Optional[str] = None
+
+
+def json_response(payload: Any, request: Request, status_code: int = 200) -> Response:
+    """
+    Serialize payload with the fast encoder and compress it according to
+    the client's Accept-Encoding.
+    """
+    body, headers = encode_json(payload, request.headers.get("accept-encoding"))
+    return Response(
+        content=body,
+        status_code=status_code,
+        media_type="application/json",
+        headers=headers,
+    )
 
 @app.post("/login", response_model=TokenResponse)
-def login(data: LoginRequest):
+def login(data: LoginRequest, background_tasks: BackgroundTasks):
     start = time.perf_counter()
     conn = get_db_connection()
     cur = conn.cursor(dictionary=True)
@@ -228,6 +423,10 @@ def login(data: LoginRequest):
             meta={"email": user["email"]},
         )
 
+        # Warm the student's profile snapshot after the response is sent
+        if profile_cache and role == "student":
+            background_tasks.add_task(profile_cache.prefetch, int(user["id"]))
+
         return {"access_token": token, "token_type": "bearer"}
 
     finally:
@@ -244,6 +443,16 @@ def get_current_user(auth: HTTPAuthorizationCredentials = Depends(oauth2_scheme)
 # -------------------------
 # AI & Logic
 # -------------------------
+def _record_usage(sp: dict, resp):
+    """Response size and token counts of a Gemini call on its trace span."""
+    if not active():
+        return
+    sp["response_chars"] = len(resp.text or "")
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is not None:
+        sp["prompt_tokens"] = getattr(usage, "prompt_token_count", None)
+        sp["output_tokens"] = getattr(usage, "candidates_token_count", None)
+
 class ChatSQLHelper:
     def __init__(self, client, model):
         self.client = client
@@ -268,7 +477,9 @@ class ChatSQLHelper:
         User Question: "{nl_query}"
         """
         try:
-            resp = self.client.models.generate_content(model=self.model, contents=prompt)
+            with span("gemini.generate_sql", prompt_chars=len(prompt)) as sp:
+                resp = self.client.models.generate_content(model=self.model, contents=prompt)
+                _record_usage(sp, resp)
             text = resp.text.replace("```sql", "").replace("```", "").strip()
             return text
         except Exception as e:
@@ -296,21 +507,49 @@ class ChatSQLHelper:
             """
 
         try:
-            resp = self.client.models.generate_content(model=self.model, contents=prompt)
+            stage = "gemini.chitchat" if is_chitchat else "gemini.summarize"
+            with span(stage, prompt_chars=len(prompt)) as sp:
+                resp = self.client.models.generate_content(model=self.model, contents=prompt)
+                _record_usage(sp, resp)
             return resp.text.strip()
         except Exception as e:
             return f"I found data but couldn't summarize it. Error: {e}"
 
-chat_helper = ChatSQLHelper(genai_client, GENAI_MODEL)
+# client is attached by _init_genai_client() (warmup or first chat)
+chat_helper = ChatSQLHelper(None, GENAI_MODEL)
 
 # -------------------------
 # Chat Endpoint
 # -------------------------
 @app.post("/chat")
-def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
+def chat_endpoint(req: ChatRequest, request: Request, user=Depends(get_current_user)):
+    role = user.get("role")
+    klass = "teacher_chat" if role == "teacher" else "student_chat"
+    # Profiled on request (X-Profile header / teacher flag) or when sampled
+    plan = profiler.decide(
+        request.headers.get("x-profile"), request.headers.get("x-profile-token"), req.profile, role
+    )
+    tracing = (
+        profiler.trace(plan["reason"], plan["flame"], role=role, user_id=user.get("sub"),
+                       message_chars=len(req.message))
+        if plan
+        else nullcontext()
+    )
+    with tracing as trace:
+        with scheduler.admit(klass, user.get("sub")):
+            payload = run_chat(req, user)
+        with span("serialize") as sp:
+            response = json_response(payload, request)
+            sp["bytes"] = len(response.body)
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.id
+    return response
+
+
+def run_chat(req: ChatRequest, user: dict) -> dict:
     start = time.perf_counter()
 
-    if not genai_client:
+    if not genai_resource.get():
         latency_ms = int((time.perf_counter() - start) * 1000)
         log_kpi_event(
             event_type="chat_error",
@@ -328,16 +567,37 @@ def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
     user_id = int(user.get("sub") or user.get("id"))
     role = user.get("role", "student")
 
-    schema_text = "\n".join(
-        [f"- {t}: {ALLOWED_COLUMNS.get(t)}" for t in ALLOWED_TABLES_WITH_TEACHERS]
-    )
-    if role == "student":
-        context = f"User is Student (ID: {user_id}). MUST filter by `student_id = {user_id}`."
-    else:
-        context = "User is Teacher."
+    with span("prompt_build") as sp:
+        allowed_columns = get_allowed_columns()
+        schema_text = "\n".join(
+            [f"- {t}: {allowed_columns.get(t)}" for t in ALLOWED_TABLES_WITH_TEACHERS]
+        )
+        if aggregates and role == "teacher":
+            summary_lines = aggregates.schema_lines()
+            if summary_lines:
+                schema_text += (
+                    "\nPrecomputed summary tables (prefer these for class/subject averages, "
+                    "attendance percentages and fee dues):\n" + "\n".join(summary_lines)
+                )
+        if role == "student":
+            context = f"User is Student (ID: {user_id}). MUST filter by `student_id = {user_id}`."
+        else:
+            context = "User is Teacher."
+        sp["schema_chars"] = len(schema_text)
 
     # 2. Generate SQL (or NOT_SQL / ERROR)
-    sql_or_response = chat_helper.generate_sql(req.message, schema_text, context)
+    # NL -> SQL is cached across workers; the key covers the schema and the user context
+    nl_key = "nl2sql:" + hashlib.sha1(
+        "\x1f".join([schema_text, context, " ".join(req.message.lower().split())]).encode("utf-8")
+    ).hexdigest()
+    with span("nl2sql_cache.get") as sp:
+        sql_or_response = shared_cache.get(nl_key)
+        sp["hit"] = sql_or_response is not None
+    if sql_or_response is None:
+        with scheduler.slot("llm"):
+            sql_or_response = chat_helper.generate_sql(req.message, schema_text, context)
+        if not sql_or_response.startswith("ERROR:"):
+            shared_cache.set(nl_key, sql_or_response, NL2SQL_CACHE_TTL_SECONDS)
 
     # Case A: AI Error
     if sql_or_response.startswith("ERROR:"):
@@ -354,9 +614,10 @@ def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
 
     # Case B: Chit-Chat
     if sql_or_response == "NOT_SQL":
-        summary = chat_helper.generate_human_response(
-            req.message, "", [], is_chitchat=True
-        )
+        with scheduler.slot("llm"):
+            summary = chat_helper.generate_human_response(
+                req.message, "", [], is_chitchat=True
+            )
         latency_ms = int((time.perf_counter() - start) * 1000)
         log_kpi_event(
             event_type="chat_chitchat",
@@ -374,83 +635,115 @@ def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
     # ---------------------------------------------------------
     # 3. STRONG STUDENT PRIVACY ENFORCEMENT
     # ---------------------------------------------------------
-    import re
+    with span("privacy_check", role=role) as sp:
+        import re
 
-    def extract_tables(sql):
-        """
-        Extract table names from SQL query safely.
-        Returns a set of table names in lowercase.
-        """
-
-        sql = sql.lower()
+        def extract_tables(sql):
+            """
+            Extract table names from SQL query safely.
+            Returns a set of table names in lowercase.
+            """
 
-        # Match FROM <table> OR JOIN <table>
-        matches = re.findall(r"(from|join)\s+([a-zA-Z0-9_]+)", sql)
+            sql = sql.lower()
 
-        tables = set()
-        for m in matches:
-            tables.add(m[1])
+            # Match FROM <table> OR JOIN <table>
+            matches = re.findall(r"(from|join)\s+([a-zA-Z0-9_]+)", sql)
 
-        return tables
+            tables = set()
+            for m in matches:
+                tables.add(m[1])
 
-    tables = extract_tables(sql)
-    lower_sql = sql.lower()
+            return tables
 
-    if role == "student":
+        tables = extract_tables(sql)
+        lower_sql = sql.lower()
+        sp["tables"] = sorted(tables)
 
-        # 3A — Completely forbid access to teachers table
-        if "teachers" in tables:
-            return {
-                "summary": "Access denied. Students cannot view teacher data.",
-                "results": [],
-                "sql": None
-            }
+        if role == "student":
 
-        # 3B — Forbid access to ALL other students
-        # If the query touches the students table, enforce students.id = current_user
-        if "students" in tables:
-            if f"students.id = {user_id}" not in lower_sql and f"students.id={user_id}" not in lower_sql:
+            # 3A — Completely forbid access to teachers table
+            if "teachers" in tables:
                 return {
-                    "summary": "Access denied. Students cannot view other students’ information.",
+                    "summary": "Access denied. Students cannot view teacher data.",
                     "results": [],
                     "sql": None
                 }
 
-        # 3C — For ANY table that uses student_id, enforce their own ID
-        needs_filter = False
-
-        # List of tables with student_id column
-        student_related_tables = {
-            "attendance",
-            "fee_payments",
-            "academic_marks",
-            "hostel_transport",
-            "medical_info",
-            "student_details",
-        }
-
-        for t in tables:
-            if t in student_related_tables:
-                needs_filter = True
-
-        # If query involves student data but does NOT filter by their own ID, force block
-        if needs_filter:
-            if f"student_id = {user_id}" not in lower_sql and f"student_id={user_id}" not in lower_sql:
+            # Class-level summaries (no student_id column) are teacher-only
+            if "agg_class_subject_marks" in tables:
                 return {
-                    "summary": "Access denied. Students cannot view other students’ records.",
+                    "summary": "Access denied. Class summaries are available to teachers only.",
                     "results": [],
                     "sql": None
                 }
 
+            # 3B — Forbid access to ALL other students
+            # If the query touches the students table, enforce students.id = current_user
+            if "students" in tables:
+                if f"students.id = {user_id}" not in lower_sql and f"students.id={user_id}" not in lower_sql:
+                    return {
+                        "summary": "Access denied. Students cannot view other students’ information.",
+                        "results": [],
+                        "sql": None
+                    }
+
+            # 3C — For ANY table that uses student_id, enforce their own ID
+            needs_filter = False
+
+            # List of tables with student_id column
+            student_related_tables = {
+                "attendance",
+                "fee_payments",
+                "academic_marks",
+                "hostel_transport",
+                "medical_info",
+                "student_details",
+                # per-student summary tables: a student can only read their own row
+                "agg_student_attendance",
+                "agg_student_fees",
+            }
+
+            for t in tables:
+                if t in student_related_tables:
+                    needs_filter = True
+
+            # If query involves student data but does NOT filter by their own ID, force block
+            if needs_filter:
+                if f"student_id = {user_id}" not in lower_sql and f"student_id={user_id}" not in lower_sql:
+                    return {
+                        "summary": "Access denied. Students cannot view other students’ records.",
+                        "results": [],
+                        "sql": None
+                    }
+
+
+    # 4. Execute (student queries try their in-process profile snapshot first)
+    rows = None
+    source = "mysql"
+    if profile_cache and role == "student":
+        with span("snapshot.query") as sp:
+            try:
+                rows = profile_cache.query(user_id, sql)
+                source = "snapshot"
+            except SnapshotMiss:
+                rows = None
+            sp["hit"] = rows is not None
 
-    # 4. Execute
-    rows = []
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute(sql)
-        rows = cur.fetchall()
-        conn.close()
+        if rows is None:
+            with scheduler.slot("db"):
+                db_start = time.perf_counter()
+                with span("db.connect"):
+                    conn = get_db_connection()
+                cur = conn.cursor(dictionary=True)
+                with span("db.execute", sql_chars=len(sql)):
+                    cur.execute(sql)
+                with span("db.fetch") as sp:
+                    rows = cur.fetchall()
+                    sp["rows"] = len(rows)
+                conn.close()
+            if profile_cache and role == "student":
+                profile_cache.record_mysql_latency((time.perf_counter() - db_start) * 1000)
     except Exception as e:
         latency_ms = int((time.perf_counter() - start) * 1000)
         log_kpi_event(
@@ -464,7 +757,11 @@ def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
         return {"summary": f"Database Error: {e}", "results": []}
 
     # 5. Summarize
-    summary = chat_helper.generate_human_response(req.message, sql, rows)
+    with scheduler.slot("llm"):
+        summary = chat_helper.generate_human_response(req.message, sql, rows)
+
+    if active():
+        annotate(rows=len(rows), source=source, result_bytes=len(dumps(rows)))
 
     latency_ms = int((time.perf_counter() - start) * 1000)
     log_kpi_event(
@@ -477,15 +774,130 @@ def chat_endpoint(req: ChatRequest, user=Depends(get_current_user)):
             "message": req.message,
             "sql": sql,
             "row_count": len(rows),
+            "source": source,
         },
     )
 
+    # Remember the validated SQL so the turn can be exported in full later
+    turn_id = uuid.uuid4().hex
+    with span("chat_turn.store"):
+        shared_cache.set(
+            f"chat_turn:{turn_id}",
+            {"sql": sql, "user_id": user_id, "role": role, "message": req.message},
+            EXPORT_TURN_TTL_SECONDS,
+        )
+
+    results = rows[:CHAT_PREVIEW_ROWS]
     return {
         "summary": summary,
-        "results": rows[:50],
+        "results": results if req.format == "records" else to_columnar(results),
         "sql": sql,
+        "turn_id": turn_id,
+        "row_count": len(rows),
+        "truncated": len(rows) > CHAT_PREVIEW_ROWS,
     }
 
+
+# -------------------------
+# Export Endpoint
+# -------------------------
+@app.get("/chat/export/{turn_id}")
+def chat_export(turn_id: str, format: str = "csv", user=Depends(get_current_user)):
+    """
+    Stream the full result of a previous chat turn as CSV or NDJSON.
+    Re-runs the turn's validated SQL on an unbuffered cursor (constant memory).
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(EXPORT_FORMATS)}")
+
+    turn = shared_cache.get(f"chat_turn:{turn_id}")
+    if not turn or str(turn["user_id"]) != str(user.get("sub")):
+        raise HTTPException(status_code=404, detail="Chat result not found or expired")
+
+    sql = turn["sql"].strip().rstrip(";")
+    if not re.match(r"^\s*(select|with)\b", sql, re.I):
+        raise HTTPException(status_code=400, detail="Only SELECT results can be exported")
+
+    user_id = int(user["sub"])
+    start = time.perf_counter()
+
+    # A download can last minutes: it holds an export slot, not one of the shared
+    # DB slots that chat queries wait on. Taken before the response starts so a
+    # busy server still answers 503 + Retry-After instead of a truncated 200.
+    try:
+        with scheduler.admit("teacher_chat", user.get("sub")):
+            held = scheduler.hold("export")
+    except SchedulerRejected as e:
+        log_kpi_event(
+            event_type="export_error",
+            user_id=user_id,
+            role=user.get("role"),
+            success=False,
+            latency_ms=int((time.perf_counter() - start) * 1000),
+            meta={"sql": sql, "format": format, "rejected": e.status_code, "error": e.detail},
+        )
+        raise
+
+    def generate():
+        stats = {}
+        success = False
+        try:
+            yield from stream_query(get_db_connection, sql, format, EXPORT_CHUNK_ROWS, stats)
+            success = True
+        finally:
+            held.release()
+            log_kpi_event(
+                event_type="export_success" if success else "export_error",
+                user_id=user_id,
+                role=user.get("role"),
+                success=success,
+                latency_ms=int((time.perf_counter() - start) * 1000),
+                meta={"sql": sql, "format": format, **stats},
+            )
+
+    # The background task runs once the response is over, also when the client
+    # went away before the body started and generate() never ran
+    return StreamingResponse(
+        generate(),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="chat_{turn_id[:8]}.{format}"'},
+        background=BackgroundTask(held.release),
+    )
+
+# -------------------------
+# Health / Lifecycle
+# -------------------------
+@app.get("/health/live")
+def health_live():
+    """Process is up and serving requests."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready():
+    """
+    Ready once Gemini and the schema are initialized. A probe starts (in the
+    background) any build that hasn't happened yet - with STARTUP_WARMUP=off no
+    traffic arrives before the worker is ready - and retries failed resources
+    subject to their backoff, so a worker that started without MySQL becomes
+    ready once it's reachable.
+    """
+    for r in (genai_resource, schema_resource):
+        if r.state in ("pending", "failed"):
+            r.warm_in_background()
+    components = {r.name: r.state for r in lifecycle.resources}
+    ready = genai_resource.ready and schema_resource.ready
+    return JSONResponse(
+        {"status": "ready" if ready else "starting", "components": components},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/health/startup")
+def health_startup():
+    """Startup-time breakdown per component."""
+    return lifecycle.report()
+
 @app.get("/me")
 def me(user=Depends(get_current_user)):
     conn = None
@@ -528,67 +940,151 @@ def kpi_summary(user=Depends(get_current_user)):
     if user.get("role") != "teacher":
         raise HTTPException(status_code=403, detail="Teacher only")
 
-    conn = get_db_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        # Total chat queries
-        cur.execute(
-            """
-            SELECT
-              COUNT(*) AS total_queries,
-              SUM(CASE WHEN event_type = 'chat_success' AND is_success = 1 THEN 1 ELSE 0 END) AS success_queries,
-              AVG(CASE WHEN event_type LIKE 'chat_%' AND response_time_ms IS NOT NULL THEN response_time_ms END) AS avg_response_ms,
-              SUM(CASE WHEN event_type = 'chat_error' THEN 1 ELSE 0 END) AS error_events
-            FROM kpi_events
-            """
-        )
-        row = cur.fetchone() or {}
+    with scheduler.admit("kpi", user.get("sub")), scheduler.slot("db"):
+        stats = kpi_store.dashboard()["stats"]
 
-        total_queries = row["total_queries"] or 0
-        success_queries = row["success_queries"] or 0
-        error_events = row["error_events"] or 0
-        avg_response_ms = row["avg_response_ms"]
+    total_queries = stats["total_queries"]
+    total_logins = stats["login_success"] + stats["login_failed"]
 
-        # Login success rate
-        cur.execute(
-            """
-            SELECT
-              COUNT(*) AS total_logins,
-              SUM(CASE WHEN event_type = 'login_success' THEN 1 ELSE 0 END) AS success_logins
-            FROM kpi_events
-            WHERE event_type LIKE 'login_%'
-            """
-        )
-        log_row = cur.fetchone() or {}
-        total_logins = log_row["total_logins"] or 0
-        success_logins = log_row["success_logins"] or 0
+    login_success_rate = (
+        round(stats["login_success"] * 100.0 / total_logins, 2) if total_logins > 0 else None
+    )
+    query_success_rate = (
+        round(stats["success_count"] * 100.0 / total_queries, 2)
+        if total_queries > 0
+        else None
+    )
+    api_error_rate = (
+        round(stats["error_count"] * 100.0 / total_queries, 2)
+        if total_queries > 0
+        else None
+    )
 
-        login_success_rate = (
-            round(success_logins * 100.0 / total_logins, 2) if total_logins > 0 else None
-        )
-        query_success_rate = (
-            round(success_queries * 100.0 / total_queries, 2)
-            if total_queries > 0
-            else None
-        )
-        api_error_rate = (
-            round(error_events * 100.0 / total_queries, 2)
-            if total_queries > 0
-            else None
-        )
+    return {
+        "total_queries": total_queries,
+        "chat_success_rate_percent": query_success_rate,
+        "avg_chat_response_ms": stats["avg_response_time"] if total_queries > 0 else None,
+        "api_error_rate_percent": api_error_rate,
+        "total_logins": total_logins,
+        "login_success_rate_percent": login_success_rate,
+    }
 
-        return {
-            "total_queries": total_queries,
-            "chat_success_rate_percent": query_success_rate,
-            "avg_chat_response_ms": avg_response_ms,
-            "api_error_rate_percent": api_error_rate,
-            "total_logins": total_logins,
-            "login_success_rate_percent": login_success_rate,
-        }
+@app.get("/kpi/dashboard")
+def kpi_dashboard(user=Depends(get_current_user)):
+    """
+    Everything the KPI dashboard charts (archive + live events).
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+
+    with scheduler.admit("kpi", user.get("sub")), scheduler.slot("db"):
+        return kpi_store.dashboard()
+
+@app.get("/kpi/archive")
+def kpi_archive_report(user=Depends(get_current_user)):
+    """
+    kpi_events table size / scan time and archive compression.
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+
+    with scheduler.admit("kpi", user.get("sub")), scheduler.slot("db"):
+        return {"table": table_report(get_db_connection), "archive": kpi_archive.report()}
+
+@app.get("/kpi/scheduler")
+def kpi_scheduler(user=Depends(get_current_user)):
+    """
+    Queue depths, wait times and rejections per workload class.
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    return scheduler.report()
+
+@app.get("/kpi/cache")
+def kpi_cache(user=Depends(get_current_user)):
+    """
+    Hit / miss / eviction counters for this worker's view of the cache tiers.
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    return shared_cache.stats()
+
+@app.get("/kpi/profile-cache")
+def kpi_profile_cache(user=Depends(get_current_user)):
+    """
+    Hit rate and estimated latency saved by the student profile snapshots.
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    if not profile_cache:
+        return {"enabled": False}
+    return {"enabled": True, **profile_cache.report()}
+
+@app.get("/kpi/aggregates")
+def kpi_aggregates(user=Depends(get_current_user)):
+    """
+    Refresh state of the materialized summary tables.
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    if not aggregates:
+        return {"enabled": False}
+
+    with scheduler.admit("kpi", user.get("sub")), scheduler.slot("db"):
+        state = aggregates.status()
+    return {"enabled": True, "tables": state, "refresher": aggregate_refresher.report()}
+
+@app.post("/kpi/aggregates/refresh")
+def kpi_aggregates_refresh(full: bool = False, user=Depends(get_current_user)):
+    """
+    Refresh the summary tables now (incremental unless ?full=true).
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    if not aggregates:
+        raise HTTPException(status_code=404, detail="Aggregates are disabled")
+
+    with scheduler.admit("kpi", user.get("sub")):
+        results = aggregate_refresher.run_once(full=full)
+    if results is None:
+        raise HTTPException(status_code=409, detail="A refresh is already running in another worker")
+    return {"results": results}
+
+@app.get("/kpi/traces")
+def kpi_traces(limit: int = 50, min_ms: float = 0, user=Depends(get_current_user)):
+    """
+    Recent chat traces from this worker's ring buffer (newest first), with per-stage timings.
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    return {"profiler": profiler.report(), "traces": profiler.buffer.list(limit, min_ms)}
+
+@app.get("/kpi/traces/{trace_id}")
+def kpi_trace(trace_id: str, user=Depends(get_current_user)):
+    """
+    One trace with all its spans (sizes, token counts, nested waits).
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    trace = profiler.buffer.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found (evicted, or recorded by another worker)")
+    return trace.to_dict()
+
+@app.get("/kpi/traces/{trace_id}/flamegraph")
+def kpi_trace_flamegraph(trace_id: str, user=Depends(get_current_user)):
+    """
+    Collapsed stacks for flamegraph.pl / speedscope (requests profiled with "flame").
+    """
+    if user.get("role") != "teacher":
+        raise HTTPException(status_code=403, detail="Teacher only")
+    trace = profiler.buffer.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found (evicted, or recorded by another worker)")
+    if trace.flamegraph is None:
+        raise HTTPException(status_code=404, detail="Trace was recorded without a flamegraph")
+    return Response(content=trace.collapsed_stacks(), media_type="text/plain")
 
-    finally:
-        cur.close()
-        conn.close()
 @app.get("/kpi/daily-usage")
 def kpi_daily_usage(user=Depends(get_current_user)):
     """
@@ -597,23 +1093,8 @@ def kpi_daily_usage(user=Depends(get_current_user)):
     if user.get("role") != "teacher":
         raise HTTPException(status_code=403, detail="Teacher only")
 
-    conn = get_db_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute(
-            """
-            SELECT
-              DATE(created_at) AS day,
-              SUM(CASE WHEN event_type = 'chat_success' THEN 1 ELSE 0 END) AS successful_chats,
-              SUM(CASE WHEN event_type = 'chat_error' THEN 1 ELSE 0 END) AS chat_errors
-            FROM kpi_events
-            WHERE event_type LIKE 'chat_%'
-            GROUP BY DATE(created_at)
-            ORDER BY day ASC
-            """
-        )
-        rows = cur.fetchall()
-        return rows
-    finally:
-        cur.close()
-        conn.close()
+    with scheduler.admit("kpi", user.get("sub")), scheduler.slot("db"):
+        return kpi_store.daily_usage()
+
+
+lifecycle.mark_imported()
@@ -0,0 +1,543 @@
+"""
+Per-student profile snapshots.
+
+On login we pull every row that belongs to a student (their `students` row plus
+their slice of the student-scoped tables) in ONE multi-statement round trip and
+keep it in a bounded, TTL'd in-process cache. Student-scoped SQL that already
+passed the privacy checks can then run against an in-memory SQLite copy of
+those rows instead of the remote MySQL server.
+
+SQLite and MySQL disagree on some SQL that both accept (integer division,
+case-sensitive `=`, CONCAT with NULLs, '5' = 5, `class = 9` ...), so only a
+whitelist of query shapes runs on the snapshot: one snapshot table, plain column /
+literal comparisons where the literal has the column's kind (number vs text),
+COUNT/SUM/AVG/MIN/MAX, GROUP BY / ORDER BY / LIMIT. Snapshot columns get the
+SQLite affinity of their MySQL type, and text columns mirror their MySQL
+collation (case / accent sensitivity, PAD SPACE vs NO PAD); a query touching a
+column whose collation isn't mirrored is not run here. Anything else raises
+SnapshotMiss and the caller falls back to MySQL.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# table -> column holding the student's id
+SNAPSHOT_TABLES = {
+    "students": "id",
+    "student_details": "student_id",
+    "attendance": "student_id",
+    "fee_payments": "student_id",
+    "academic_marks": "student_id",
+    "hostel_transport": "student_id",
+    "medical_info": "student_id",
+}
+
+# Never copied into the snapshot
+EXCLUDED_COLUMNS = {"password"}
+
+# Functions whose result is the same on both engines (for the whitelisted shapes)
+PORTABLE_FUNCTIONS = {"count", "sum", "avg", "min", "max"}
+# Case folding only when the result feeds a LIKE (ci either way); `LOWER(x) = 'Y'` differs
+CASE_FUNCTIONS = {"lower", "upper", "lcase", "ucase"}
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<str>'(?:[^'\\]|'')*')
+      | (?P<num>\d+(?:\.\d+)?)
+      | (?P<ident>`[^`]+`|[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op><=|>=|<>|!=|\|\||[=<>(),.*+\-])
+    )""",
+    re.X,
+)
+_NUMERIC_TEXT = re.compile(r"^\s*[-+]?\d+(\.\d+)?\s*$")
+
+# MySQL DATA_TYPE -> SQLite column affinity; anything else is declared without one
+INTEGER_TYPES = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year"}
+REAL_TYPES = {"decimal", "numeric", "float", "double", "real"}
+TEXT_TYPES = {"char", "varchar", "tinytext", "text", "mediumtext", "longtext", "enum", "set",
+              "date", "datetime", "timestamp", "time", "json"}
+
+# Collations mirrored on the snapshot, by name without the charset prefix:
+# (case-insensitive, accent-insensitive). Language-specific ones (sv, de_pb ...) are not.
+MIRRORED_COLLATIONS = {
+    "general_ci": (True, True),
+    "unicode_ci": (True, True),
+    "unicode_520_ci": (True, True),
+    "0900_ai_ci": (True, True),
+    "uca1400_ai_ci": (True, True),
+    "0900_as_ci": (True, False),
+    "0900_as_cs": (False, False),
+    "bin": (False, False),
+    "0900_bin": (False, False),
+}
+UNICODE_CHARSETS = ("utf8", "utf8mb3", "utf8mb4")
+
+# Operators across which MySQL converts a text operand to a number
+_COMPARE_OPS = {"=", "<", ">", "<=", ">=", "<>", "!=", "+", "-", "*"}
+
+
+class SnapshotMiss(Exception):
+    """The query can't be answered from the snapshot; use MySQL instead."""
+
+
+def _sqlite_value(v: Any):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (datetime, date, dtime)):
+        return v.isoformat(sep=" ") if isinstance(v, datetime) else v.isoformat()
+    if isinstance(v, timedelta):
+        return str(v)
+    if isinstance(v, (bytes, bytearray)):
+        return bytes(v)
+    return v
+
+
+def _tokens(sql: str) -> Optional[List[Tuple[str, str]]]:
+    """(kind, text) tokens, or None if the SQL has anything outside the whitelist grammar."""
+    sql = sql.strip().rstrip(";").strip()
+    out, pos = [], 0
+    while pos < len(sql):
+        m = _TOKEN.match(sql, pos)
+        if not m or m.end() == pos:
+            if sql[pos:].strip() == "":
+                break
+            return None
+        kind = m.lastgroup
+        out.append((kind, m.group(kind)))
+        pos = m.end()
+    return out
+
+
+def _after_call(tokens: List[Tuple[str, str]], open_at: int) -> str:
+    """Text of the token following the parenthesis opened at `open_at`."""
+    depth = 0
+    for j in range(open_at, len(tokens)):
+        if tokens[j][1] == "(":
+            depth += 1
+        elif tokens[j][1] == ")":
+            depth -= 1
+            if depth == 0:
+                return tokens[j + 1][1] if j + 1 < len(tokens) else ""
+    return ""
+
+
+def is_portable(sql: str) -> bool:
+    """
+    True if `sql` is a query shape that gives the same answer on the snapshot as
+    on MySQL. Rejected: joins / subqueries / several tables, arithmetic division,
+    `||`, functions other than COUNT/SUM/AVG/MIN/MAX, double-quoted strings,
+    backslash escapes. Literal vs column types are checked by literal_kind_mismatch.
+    """
+    tokens = _tokens(sql)
+    if not tokens or tokens[0][1].lower() != "select":
+        return False
+    tables = 0
+    for i, (kind, text) in enumerate(tokens):
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else ""
+        if kind == "op" and text == "||":
+            return False
+        elif kind == "ident":
+            word = text.strip("`").lower()
+            if nxt == "(":
+                if word in CASE_FUNCTIONS:
+                    if _after_call(tokens, i + 1).lower() != "like":
+                        return False
+                elif word not in PORTABLE_FUNCTIONS and word != "in":
+                    return False
+            elif word == "select" and i > 0:
+                return False
+            elif word in ("join", "union", "div", "mod", "regexp", "rlike", "collate", "binary"):
+                return False
+            if word == "from":
+                if i + 1 >= len(tokens) or tokens[i + 1][1].strip("`").lower() not in SNAPSHOT_TABLES:
+                    return False
+                tables += 1
+    if tables != 1:
+        return False
+    # implicit joins: FROM a, b / FROM a x, b y
+    from_at = next(i for i, (_, t) in enumerate(tokens) if t.lower() == "from")
+    tail = [t.lower() for _, t in tokens[from_at + 1:from_at + 4]]
+    return "," not in tail
+
+
+def _affinity(data_type: Optional[str]) -> str:
+    data_type = (data_type or "").lower()
+    if data_type in INTEGER_TYPES:
+        return "INTEGER"
+    if data_type in REAL_TYPES:
+        return "REAL"
+    if data_type in TEXT_TYPES:
+        return "TEXT"
+    return ""
+
+
+def _column_at(tokens: List[Tuple[str, str]], i: int) -> Optional[str]:
+    """Column name of the operand starting at i (`col` or `t.col`), lower-cased."""
+    if i < 0 or i >= len(tokens) or tokens[i][0] != "ident":
+        return None
+    if i + 2 < len(tokens) and tokens[i + 1][1] == "." and tokens[i + 2][0] == "ident":
+        i += 2
+    return tokens[i][1].strip("`").lower()
+
+
+def _column_before(tokens: List[Tuple[str, str]], i: int) -> Optional[str]:
+    """Column name of the operand ending at i."""
+    if i < 0 or i >= len(tokens) or tokens[i][0] != "ident":
+        return None
+    return tokens[i][1].strip("`").lower()
+
+
+def _operand_of(tokens: List[Tuple[str, str]], i: int) -> Optional[str]:
+    """The column the literal at i is compared with (`col = 9`, `9 < col`, `col IN (9)`, BETWEEN)."""
+    lo = i - 1 if i > 0 and tokens[i - 1][1] in ("-", "+") and (
+        i < 2 or tokens[i - 2][0] == "op") else i
+    prev = tokens[lo - 1][1].lower() if lo > 0 else ""
+    if prev in _COMPARE_OPS:
+        return _column_before(tokens, lo - 2)
+    if prev == "between":
+        return _column_before(tokens, lo - 2)
+    if prev == "and" and lo >= 3 and tokens[lo - 3][1].lower() == "between":
+        return _column_before(tokens, lo - 4)
+    if i + 1 < len(tokens) and tokens[i + 1][1] in _COMPARE_OPS:
+        return _column_at(tokens, i + 2)
+    # inside an IN (...) list
+    j = lo - 1
+    while j >= 0 and (tokens[j][0] in ("num", "str") or tokens[j][1] in (",", "-", "+")):
+        j -= 1
+    if j >= 1 and tokens[j][1] == "(" and tokens[j - 1][1].lower() == "in":
+        k = j - 2
+        if k >= 0 and tokens[k][1].lower() == "not":
+            k -= 1
+        return _column_before(tokens, k)
+    return None
+
+
+def literal_kind_mismatch(sql: str, numeric: set, other: set) -> bool:
+    """
+    True if a literal is compared with a column of the other kind: `class = 9`
+    (MySQL compares '9A' numerically and matches, SQLite compares text) or
+    `marks > 'abc'`. numeric / other are the lower-cased column names by kind.
+    """
+    tokens = _tokens(sql) or []
+    for i, (kind, text) in enumerate(tokens):
+        if kind not in ("num", "str"):
+            continue
+        column = _operand_of(tokens, i)
+        if column is None:
+            # '5' next to an expression of unknown type: MySQL may compare it as a number
+            if kind == "str" and _NUMERIC_TEXT.match(text[1:-1]):
+                return True
+            continue
+        if kind == "num" and column in other:
+            return True
+        if kind == "str" and column in numeric:
+            return True
+    return False
+
+
+def collation_rules(name: Optional[str]) -> Optional[Tuple[bool, bool, bool]]:
+    """
+    (case-insensitive, accent-insensitive, PAD SPACE) for a MySQL / MariaDB
+    collation we can mirror, else None. UCA 9.0.0 (`_0900_`) and MariaDB
+    `_nopad_` collations are NO PAD: 'a ' <> 'a'.
+    """
+    if not name:
+        return None
+    name = name.lower()
+    charset, _, rest = name.partition("_")
+    if charset not in UNICODE_CHARSETS:
+        return None
+    rules = MIRRORED_COLLATIONS.get(rest.replace("nopad_", ""))
+    if rules is None:
+        return None
+    return rules + ("0900" not in rest and "nopad" not in rest,)
+
+
+def _strip_accents(s: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+
+
+def _collation_key(s: str, ci: bool, ai: bool, pad: bool) -> str:
+    if pad:
+        s = s.rstrip(" ")
+    if ai:
+        s = _strip_accents(s)
+    return s.casefold() if ci else s
+
+
+def _collation_name(ci: bool, ai: bool, pad: bool) -> str:
+    return f"mysql_{'ci' if ci else 'cs'}_{'ai' if ai else 'as'}_{'pad' if pad else 'nopad'}"
+
+
+def _make_collation(ci: bool, ai: bool, pad: bool) -> Callable[[str, str], int]:
+    def compare(a: str, b: str) -> int:
+        a, b = _collation_key(a, ci, ai, pad), _collation_key(b, ci, ai, pad)
+        return (a > b) - (a < b)
+    return compare
+
+
+def _make_like(ci: bool, ai: bool) -> Callable:
+    """MySQL LIKE under a collation (SQLite's own LIKE only folds ASCII; LIKE never pads)."""
+    flags = re.S | (re.I if ci else 0)
+
+    def like(pattern, value, escape=None):
+        if pattern is None or value is None:
+            return None
+        esc = escape or "\\"
+        regex, i = [], 0
+        while i < len(pattern):
+            c = pattern[i]
+            if c == esc and i + 1 < len(pattern):
+                c = pattern[i + 1]
+                i += 1
+            elif c in "%_":
+                regex.append(".*" if c == "%" else ".")
+                i += 1
+                continue
+            regex.append(re.escape(_strip_accents(c) if ai else c))
+            i += 1
+        value = str(value)
+        return re.fullmatch("".join(regex), _strip_accents(value) if ai else value, flags) is not None
+
+    return like
+
+
+class ProfileSnapshot:
+    """One student's rows, loaded into a private in-memory SQLite DB."""
+
+    def __init__(self, user_id: int, tables: Dict[str, Tuple[List[str], List[tuple]]],
+                 column_info: Dict[str, Dict[str, Tuple[str, Optional[str]]]]):
+        """
+        column_info: table -> column -> (MySQL DATA_TYPE, COLLATION_NAME). Missing
+        columns count as text with a collation that isn't mirrored.
+        """
+        self.user_id = user_id
+        self.created_at = time.time()
+        self.row_count = sum(len(rows) for _, rows in tables.values())
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        for ci in (True, False):
+            for ai in (True, False):
+                for pad in (True, False):
+                    self._db.create_collation(_collation_name(ci, ai, pad), _make_collation(ci, ai, pad))
+        for name, fn in (("lower", str.lower), ("lcase", str.lower), ("upper", str.upper), ("ucase", str.upper)):
+            self._db.create_function(name, 1, lambda v, fn=fn: fn(v) if isinstance(v, str) else v,
+                                     deterministic=True)
+        # table -> (numeric columns, other columns), lower-cased
+        self._kinds: Dict[str, Tuple[set, set]] = {}
+        # text columns whose collation isn't mirrored: queries naming them go to MySQL
+        self._unmirrored: set = set()
+        like_rules = set()
+        for table, (columns, rows) in tables.items():
+            cols = [c for c in columns if c.lower() not in EXCLUDED_COLUMNS]
+            keep = [i for i, c in enumerate(columns) if c.lower() not in EXCLUDED_COLUMNS]
+            info = {k.lower(): v for k, v in (column_info.get(table) or {}).items()}
+            col_defs = []
+            numeric = set()
+            for c in cols:
+                data_type, collation = info.get(c.lower(), ("", None))
+                affinity = _affinity(data_type)
+                if affinity in ("INTEGER", "REAL"):
+                    numeric.add(c.lower())
+                definition = f'"{c}" {affinity}'
+                rules = collation_rules(collation)
+                if rules:
+                    definition += f" COLLATE {_collation_name(*rules)}"
+                    like_rules.add(rules[:2])
+                elif collation or c.lower() not in info:
+                    self._unmirrored.add(c.lower())
+                col_defs.append(definition)
+            self._kinds[table] = (numeric, {c.lower() for c in cols} - numeric)
+            col_sql = ", ".join(col_defs)
+            self._db.execute(f'CREATE TABLE "{table}" ({col_sql})')
+            if rows:
+                marks = ", ".join("?" for _ in cols)
+                self._db.executemany(
+                    f'INSERT INTO "{table}" VALUES ({marks})',
+                    [tuple(_sqlite_value(r[i]) for i in keep) for r in rows],
+                )
+        self._db.commit()
+        # SQLite's like() doesn't know the column: only mirror it when all text columns agree
+        self._like_mirrored = len(like_rules) <= 1
+        ci, ai = next(iter(like_rules), (True, True))
+        self._db.create_function("like", 2, _make_like(ci, ai), deterministic=True)
+        self._db.create_function("like", 3, _make_like(ci, ai), deterministic=True)
+
+    def query(self, sql: str) -> List[Dict[str, Any]]:
+        if not is_portable(sql):
+            raise SnapshotMiss("query shape not portable to SQLite")
+        tokens = _tokens(sql)
+        from_at = next(i for i, (_, t) in enumerate(tokens) if t.lower() == "from")
+        numeric, other = self._kinds.get(tokens[from_at + 1][1].strip("`").lower(), (set(), set()))
+        if literal_kind_mismatch(sql, numeric, other):
+            raise SnapshotMiss("literal compared with a column of another type")
+        words = {t.strip("`").lower() for kind, t in tokens if kind == "ident"}
+        if words & self._unmirrored or ("like" in words and not self._like_mirrored):
+            raise SnapshotMiss("column collation not mirrored on the snapshot")
+        with self._lock:
+            try:
+                cur = self._db.execute(sql.strip().rstrip(";"))
+                return [dict(r) for r in cur.fetchall()]
+            except sqlite3.Error as e:
+                raise SnapshotMiss(str(e))
+
+    def close(self):
+        try:
+            self._db.close()
+        except Exception:
+            pass
+
+
+class ProfileSnapshotCache:
+    """
+    Bounded LRU of ProfileSnapshot objects keyed by user id.
+
+    connect: zero-arg callable returning a mysql.connector connection.
+    """
+
+    def __init__(self, connect: Callable, max_users: int = 500, ttl_seconds: float = 300):
+        self.connect = connect
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[int, ProfileSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "prefetches": 0,
+            "prefetch_errors": 0,
+            "hits": 0,
+            "misses": 0,
+            "fallbacks": 0,
+            "evictions": 0,
+            "prefetch_ms_total": 0.0,
+            "snapshot_ms_total": 0.0,
+            "saved_ms_total": 0.0,
+        }
+        # moving average of how long the same kind of query takes on MySQL
+        self._mysql_ms_avg: Optional[float] = None
+        # table -> column -> (DATA_TYPE, COLLATION_NAME), read once (same schema for every student)
+        self.column_info: Optional[Dict[str, Dict[str, Tuple[str, Optional[str]]]]] = None
+
+    # ---- loading ----
+    def load_column_info(self, conn) -> Dict[str, Dict[str, Tuple[str, Optional[str]]]]:
+        """MySQL type and collation of every snapshot column, from information_schema."""
+        marks = ", ".join(["%s"] * len(SNAPSHOT_TABLES))
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLLATION_NAME FROM information_schema.COLUMNS "
+            f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({marks})",
+            tuple(SNAPSHOT_TABLES),
+        )
+        out: Dict[str, Dict[str, Tuple[str, Optional[str]]]] = {}
+        for table, column, data_type, collation in cur.fetchall():
+            out.setdefault(table, {})[column] = (data_type, collation)
+        cur.close()
+        return out
+
+    def fetch_rows(self, user_id: int) -> Dict[str, Tuple[List[str], List[tuple]]]:
+        """Pull every student-scoped table for user_id in one multi-statement round trip."""
+        uid = int(user_id)
+        tables = list(SNAPSHOT_TABLES.items())
+        sql = " ".join(
+            f"SELECT * FROM `{t}` WHERE `{col}` = {uid};" for t, col in tables
+        )
+        out = {}
+        conn = self.connect()
+        try:
+            if self.column_info is None:
+                self.column_info = self.load_column_info(conn)
+            cur = conn.cursor()
+            # The iterator yields the same cursor for every statement: read each
+            # result set before advancing, or the next step discards / rejects it.
+            pending = iter(tables)
+            for result in cur.execute(sql, multi=True):
+                if result.with_rows:
+                    table, _ = next(pending)
+                    out[table] = (list(result.column_names), result.fetchall())
+            cur.close()
+        finally:
+            conn.close()
+        return out
+
+    def prefetch(self, user_id: int):
+        """Build (or rebuild) a user's snapshot. Safe to run as a background task."""
+        start = time.perf_counter()
+        try:
+            snap = ProfileSnapshot(int(user_id), self.fetch_rows(user_id), self.column_info)
+        except Exception as e:
+            self.stats["prefetch_errors"] += 1
+            print("Profile snapshot prefetch failed:", e)
+            return
+        with self._lock:
+            old = self._items.pop(snap.user_id, None)
+            if old:
+                old.close()
+            self._items[snap.user_id] = snap
+            while len(self._items) > self.max_users:
+                _, evicted = self._items.popitem(last=False)
+                evicted.close()
+                self.stats["evictions"] += 1
+            self.stats["prefetches"] += 1
+            self.stats["prefetch_ms_total"] += (time.perf_counter() - start) * 1000
+
+    def get(self, user_id: int) -> Optional[ProfileSnapshot]:
+        with self._lock:
+            snap = self._items.get(int(user_id))
+            if snap is None:
+                return None
+            if time.time() - snap.created_at > self.ttl_seconds:
+                self._items.pop(snap.user_id, None)
+                snap.close()
+                return None
+            self._items.move_to_end(snap.user_id)
+            return snap
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            snap = self._items.pop(int(user_id), None)
+        if snap:
+            snap.close()
+
+    # ---- querying ----
+    def query(self, user_id: int, sql: str) -> List[Dict[str, Any]]:
+        """Run already-validated student SQL against the snapshot or raise SnapshotMiss."""
+        snap = self.get(user_id)
+        if snap is None:
+            self.stats["misses"] += 1
+            raise SnapshotMiss("no snapshot")
+        start = time.perf_counter()
+        try:
+            rows = snap.query(sql)
+        except SnapshotMiss:
+            self.stats["fallbacks"] += 1
+            raise
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stats["hits"] += 1
+        self.stats["snapshot_ms_total"] += elapsed
+        if self._mysql_ms_avg is not None:
+            self.stats["saved_ms_total"] += max(self._mysql_ms_avg - elapsed, 0.0)
+        return rows
+
+    def record_mysql_latency(self, ms: float):
+        """Feed MySQL execute+fetch timings so we can estimate time saved per hit."""
+        if self._mysql_ms_avg is None:
+            self._mysql_ms_avg = ms
+        else:
+            self._mysql_ms_avg = 0.9 * self._mysql_ms_avg + 0.1 * ms
+
+    def report(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        lookups = s["hits"] + s["misses"] + s["fallbacks"]
+        s["cached_users"] = len(self._items)
+        s["hit_rate_percent"] = round(s["hits"] * 100.0 / lookups, 2) if lookups else None
+        s["avg_snapshot_query_ms"] = round(s["snapshot_ms_total"] / s["hits"], 3) if s["hits"] else None
+        s["avg_mysql_query_ms"] = round(self._mysql_ms_avg, 3) if self._mysql_ms_avg is not None else None
+        s["avg_prefetch_ms"] = round(s["prefetch_ms_total"] / s["prefetches"], 3) if s["prefetches"] else None
+        return s
@@ -0,0 +1,240 @@
+"""
+On-demand per-request profiling.
+
+A request is profiled when an operator asks for it (X-Profile header plus the
+X-Profile-Token secret, or the teacher-only `profile` chat flag) or when it falls in the
+sampled percentage. While a Trace is active, `span()` records the stages of the
+request - prompt build, Gemini calls, privacy check, DB execute / fetch,
+summarization, KPI write - with timings and sizes. Outside a trace `span()` is a
+no-op, so the instrumentation stays in place at ~zero cost.
+
+With flame=True a sampling profiler snapshots the request thread's stack every
+few ms and the trace carries collapsed stacks ("a;b;c 12" lines), which
+flamegraph.pl and speedscope read directly.
+
+Finished traces go to a bounded in-memory ring buffer (per worker).
+"""
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("profile_trace", default=None)
+
+# Stack frames kept per flamegraph sample (leaf side is dropped beyond this)
+MAX_STACK_DEPTH = 64
+
+
+class Trace:
+    def __init__(self, reason: str, meta: Optional[Dict[str, Any]] = None):
+        self.id = uuid.uuid4().hex[:16]
+        self.reason = reason
+        self.meta = dict(meta or {})
+        self.started_at = datetime.utcnow().isoformat(timespec="milliseconds")
+        self.spans: List[Dict[str, Any]] = []
+        self.total_ms: Optional[float] = None
+        self.flamegraph: Optional[Counter] = None
+        self.flame_samples = 0
+        self._t0 = time.perf_counter()
+        self._depth = 0
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        stages: Dict[str, float] = {}
+        for s in self.spans:
+            if s["depth"] == 0:
+                stages[s["name"]] = round(stages.get(s["name"], 0.0) + s["ms"], 2)
+        return {
+            "id": self.id,
+            "started_at": self.started_at,
+            "reason": self.reason,
+            "total_ms": self.total_ms,
+            "stages": stages,
+            "flamegraph": self.flamegraph is not None,
+            **self.meta,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.summary(), "spans": self.spans, "flame_samples": self.flame_samples}
+
+    def collapsed_stacks(self) -> str:
+        """Brendan Gregg's collapsed format: one `frame;frame;frame count` line per stack."""
+        if not self.flamegraph:
+            return ""
+        return "\n".join(f"{stack} {n}" for stack, n in self.flamegraph.most_common()) + "\n"
+
+
+def active() -> bool:
+    """True when the current request is being profiled (guard for costly size attrs)."""
+    return _current_trace.get() is not None
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    Time one stage of the current trace. Yields a dict the caller can add
+    attributes to (sizes, row counts) before the block ends.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield {}
+        return
+    record = {"name": name, "depth": trace._depth, "start_ms": round(trace.elapsed_ms(), 2), **attrs}
+    trace._depth += 1
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+        trace._depth -= 1
+        trace.spans.append(record)
+
+
+def annotate(**attrs):
+    """Attach attributes to the current trace itself (outcome, row count ...)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.meta.update(attrs)
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack every `interval` seconds into a Counter."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._done.set()
+        self.join(timeout=1)
+
+
+class TraceBuffer:
+    """Last `capacity` traces, newest first when listed."""
+
+    def __init__(self, capacity: int):
+        self._traces: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.capacity = capacity
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def list(self, limit: int = 50, min_ms: float = 0) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self._traces)
+        out = [t.summary() for t in reversed(traces) if (t.total_ms or 0) >= min_ms]
+        return out[:limit]
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            for t in self._traces:
+                if t.id == trace_id:
+                    return t
+        return None
+
+    def __len__(self):
+        return len(self._traces)
+
+
+class Profiler:
+    """
+    Decides which requests to profile and records them.
+
+    sample_percent: share of eligible requests traced without being asked.
+    token: value the X-Profile-Token header must carry (header profiling is off when empty).
+    flame_interval_ms: stack sampling period for flamegraphs.
+    max_flame: concurrent flamegraph samplers; further requests get a plain trace.
+    """
+
+    def __init__(self, capacity: int = 200, sample_percent: float = 0.0, token: str = "",
+                 flame_interval_ms: float = 5.0, max_flame: int = 2):
+        self.buffer = TraceBuffer(capacity)
+        self.sample_percent = sample_percent
+        self.token = token
+        self.flame_interval = flame_interval_ms / 1000.0
+        self._flame_slots = threading.BoundedSemaphore(max_flame)
+        self.started = {"header": 0, "flag": 0, "sampled": 0}
+
+    def decide(self, header_mode: Optional[str], header_token: Optional[str],
+               flag: Optional[str], role: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Returns {"reason", "flame"} when this request should be traced, else None.
+        Modes are "trace" or "flame".
+        """
+        if header_mode and self.token and hmac.compare_digest(header_token or "", self.token):
+            return {"reason": "header", "flame": header_mode.lower() == "flame"}
+        if flag and role == "teacher":
+            return {"reason": "flag", "flame": flag.lower() == "flame"}
+        if self.sample_percent > 0 and random.random() * 100 < self.sample_percent:
+            return {"reason": "sampled", "flame": False}
+        return None
+
+    @contextmanager
+    def trace(self, reason: str, flame: bool = False, **meta) -> Iterator[Trace]:
+        """Profile the enclosed block (must run on the request's own thread)."""
+        trace = Trace(reason, meta)
+        self.started[reason] = self.started.get(reason, 0) + 1
+        sampler = None
+        if flame and self._flame_slots.acquire(blocking=False):
+            sampler = _StackSampler(threading.get_ident(), self.flame_interval)
+            sampler.start()
+        elif flame:
+            trace.meta["flame_skipped"] = "too many concurrent flamegraphs"
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.meta["error"] = type(e).__name__
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace.total_ms = round(trace.elapsed_ms(), 2)
+            if sampler is not None:
+                sampler.stop()
+                self._flame_slots.release()
+                trace.flamegraph = sampler.stacks
+                trace.flame_samples = sampler.samples
+            self.buffer.add(trace)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self.buffer),
+            "capacity": self.buffer.capacity,
+            "sample_percent": self.sample_percent,
+            "header_enabled": bool(self.token),
+            "started": dict(self.started),
+            "pid": os.getpid(),
+        }
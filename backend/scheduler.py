@@ -0,0 +1,268 @@
+"""
+Priority-aware admission and scheduling for backend work.
+
+Every request is admitted into a workload class (teacher chat, student chat,
+KPI analytics). Scarce resources - Gemini calls ("llm"), MySQL work ("db") and
+long-running exports ("export", a small pool of their own so downloads can't
+starve chat queries) - are handed out through SlotPools: a fixed number of
+slots, one bounded FIFO queue per class, and stride scheduling between the
+queues so each class gets a share proportional to its weight. A burst in one class fills its own queue
+(and is rejected once that is full) instead of starving the others.
+
+Endpoints are sync and run in Starlette's threadpool, so waiting is a plain
+threading.Event wait - and every queued request holds a pool thread. If the
+queues could outgrow the pool, a student burst would occupy every thread and a
+teacher request would wait for a thread before the scheduler ever saw it. So
+each class caps its admitted (queued + running) requests per worker at
+`max_active`, rejected with 503 beyond that, and the caps together must leave
+`min_free_threads` of the threadpool for everything else (auth, login, health,
+export chunks, rejections).
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from profiling import span
+
+# name -> weight (share of slots under contention), queue size, in-flight requests per user,
+# admitted (queued + running) requests per worker
+DEFAULT_CLASSES = {
+    "teacher_chat": {"weight": 6, "max_queue": 50, "per_user": 4, "max_active": 10},
+    "student_chat": {"weight": 3, "max_queue": 200, "per_user": 2, "max_active": 16},
+    "kpi": {"weight": 1, "max_queue": 20, "per_user": 3, "max_active": 4},
+}
+
+# Starlette's default threadpool size (anyio's default thread limiter)
+DEFAULT_THREADPOOL_SIZE = 40
+
+_current_class: ContextVar[Optional[str]] = ContextVar("sched_class", default=None)
+
+
+class SchedulerRejected(Exception):
+    """Request refused by admission control (maps to 429 / 503)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _WaitStats:
+    """Count / mean / p95 over the most recent waits."""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total_ms = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, ms: float):
+        self.count += 1
+        self.total_ms += ms
+        self.recent.append(ms)
+
+    def report(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "avg_wait_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "p95_wait_ms": round(recent[max(int(len(recent) * 0.95) - 1, 0)], 2) if recent else None,
+            "max_wait_ms": round(recent[-1], 2) if recent else None,
+        }
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class SlotHold:
+    """One acquired slot; release() is idempotent so several cleanup paths can call it."""
+
+    def __init__(self, pool: "SlotPool"):
+        self._pool = pool
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._pool.release()
+
+
+class SlotPool:
+    """`capacity` slots shared by the classes with stride (weighted fair) scheduling."""
+
+    def __init__(self, name: str, capacity: int, classes: Dict[str, dict]):
+        self.name = name
+        self.capacity = capacity
+        self.classes = classes
+        self.in_use = 0
+        self._queues = {c: deque() for c in classes}
+        self._pass = {c: 0.0 for c in classes}
+        self._vtime = 0.0
+        self._lock = threading.Lock()
+        self.waits = {c: _WaitStats() for c in classes}
+        self.rejected = {c: 0 for c in classes}
+        self.timeouts = {c: 0 for c in classes}
+
+    def _pick_class(self) -> Optional[str]:
+        ready = [c for c, q in self._queues.items() if q]
+        if not ready:
+            return None
+        # lowest pass wins; ties go to the heavier class
+        return min(ready, key=lambda c: (self._pass[c], -self.classes[c]["weight"]))
+
+    def _activate(self, klass: str):
+        # A class that was idle doesn't get to bank credit: it joins at the virtual time.
+        self._pass[klass] = max(self._pass[klass], self._vtime)
+
+    def _charge(self, klass: str):
+        self._vtime = self._pass[klass]
+        self._pass[klass] += 1.0 / self.classes[klass]["weight"]
+
+    def acquire(self, klass: str, timeout: float):
+        start = time.perf_counter()
+        with self._lock:
+            if self.in_use < self.capacity and not any(self._queues.values()):
+                self.in_use += 1
+                self._activate(klass)
+                self._charge(klass)
+                self.waits[klass].add(0.0)
+                return
+            queue = self._queues[klass]
+            if len(queue) >= self.classes[klass]["max_queue"]:
+                self.rejected[klass] += 1
+                raise SchedulerRejected(503, f"Server busy ({self.name} queue full), try again shortly.")
+            if not queue:
+                self._activate(klass)
+            waiter = _Waiter()
+            queue.append(waiter)
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                queue.remove(waiter)
+                self.timeouts[klass] += 1
+                raise SchedulerRejected(503, f"Server busy (waited too long for {self.name}), try again shortly.")
+        self.waits[klass].add((time.perf_counter() - start) * 1000)
+
+    def release(self):
+        with self._lock:
+            klass = self._pick_class()
+            if klass is None:
+                self.in_use -= 1
+                return
+            waiter = self._queues[klass].popleft()
+            self._charge(klass)
+            # hand the slot straight to the waiter; in_use is unchanged
+            waiter.granted = True
+            waiter.event.set()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "classes": {
+                c: {
+                    "queued": len(self._queues[c]),
+                    "rejected": self.rejected[c],
+                    "timeouts": self.timeouts[c],
+                    **self.waits[c].report(),
+                }
+                for c in self.classes
+            },
+        }
+
+
+class Scheduler:
+    def __init__(self, llm_slots: int, db_slots: int, queue_timeout: float,
+                 classes: Optional[Dict[str, dict]] = None, export_slots: int = 2,
+                 threadpool_size: int = DEFAULT_THREADPOOL_SIZE, min_free_threads: int = 8):
+        self.classes = classes or DEFAULT_CLASSES
+        self.queue_timeout = queue_timeout
+        self.threadpool_size = threadpool_size
+        admitted = sum(c["max_active"] for c in self.classes.values())
+        if admitted > threadpool_size - min_free_threads:
+            raise ValueError(
+                f"scheduler classes admit {admitted} requests but the threadpool has {threadpool_size} "
+                f"threads; keep at least {min_free_threads} free (lower max_active or raise the pool size)"
+            )
+        self.pools = {
+            "llm": SlotPool("llm", llm_slots, self.classes),
+            "db": SlotPool("db", db_slots, self.classes),
+            "export": SlotPool("export", export_slots, self.classes),
+        }
+        self._user_inflight: Dict[tuple, int] = {}
+        self._active = {c: 0 for c in self.classes}
+        self._lock = threading.Lock()
+        self.admitted = {c: 0 for c in self.classes}
+        self.user_rejections = {c: 0 for c in self.classes}
+        self.class_rejections = {c: 0 for c in self.classes}
+
+    @contextmanager
+    def admit(self, klass: str, user_id: Any = None):
+        """Admit one request of `klass`; enforces the per-user and per-class concurrency caps."""
+        key = (klass, user_id)
+        with self._lock:
+            if user_id is not None and self._user_inflight.get(key, 0) >= self.classes[klass]["per_user"]:
+                self.user_rejections[klass] += 1
+                raise SchedulerRejected(429, "Too many requests in progress, please wait for the previous ones.")
+            if self._active[klass] >= self.classes[klass]["max_active"]:
+                self.class_rejections[klass] += 1
+                raise SchedulerRejected(503, "Server busy, try again shortly.", retry_after=2)
+            self._user_inflight[key] = self._user_inflight.get(key, 0) + 1
+            self._active[klass] += 1
+            self.admitted[klass] += 1
+        token = _current_class.set(klass)
+        try:
+            yield
+        finally:
+            _current_class.reset(token)
+            with self._lock:
+                self._active[klass] -= 1
+                left = self._user_inflight[key] - 1
+                if left:
+                    self._user_inflight[key] = left
+                else:
+                    del self._user_inflight[key]
+
+    def hold(self, resource: str, klass: Optional[str] = None) -> SlotHold:
+        """
+        Acquire one `resource` slot for the admitted request's class and return it;
+        the caller releases it (for slots that outlive the endpoint, e.g. a stream).
+        """
+        klass = klass or _current_class.get() or "kpi"
+        pool = self.pools[resource]
+        with span(f"wait.{resource}", klass=klass):
+            pool.acquire(klass, self.queue_timeout)
+        return SlotHold(pool)
+
+    @contextmanager
+    def slot(self, resource: str, klass: Optional[str] = None):
+        """Hold one `resource` slot for the admitted request's class."""
+        held = self.hold(resource, klass)
+        try:
+            yield
+        finally:
+            held.release()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "admitted": dict(self.admitted),
+            "active": dict(self._active),
+            "per_user_rejections": dict(self.user_rejections),
+            "class_rejections": dict(self.class_rejections),
+            "threadpool_size": self.threadpool_size,
+            "users_in_flight": len(self._user_inflight),
+            "pools": {name: pool.report() for name, pool in self.pools.items()},
+        }
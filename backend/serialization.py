@@ -0,0 +1,132 @@
+"""
+Response encoding helpers for the SchoolData API.
+
+- dumps(): fast JSON bytes (orjson when installed, stdlib json otherwise)
+  with native handling of the MySQL types we get back from cursors
+  (Decimal, date, datetime, timedelta, bytes).
+- to_columnar(): turns a list of dict rows into {"columns": [...], "rows": [[...]]}
+  so column names are sent once instead of once per row.
+- compress(): gzip / brotli negotiation from an Accept-Encoding header.
+"""
+
+import gzip
+import json
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional codec
+    brotli = None
+
+
+# Bodies smaller than this are not worth compressing (headers dominate).
+MIN_COMPRESS_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _default(obj: Any):
+    """Fallback encoder for types neither orjson nor json know about."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, dtime)):
+        return obj.isoformat()
+    if isinstance(obj, timedelta):
+        # MySQL TIME columns come back as timedelta
+        return str(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", errors="replace")
+    if isinstance(obj, set):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        obj, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def to_columnar(rows: List[Dict[str, Any]]) -> Dict[str, List]:
+    """
+    Convert dict rows (cursor(dictionary=True) output) to columnar form.
+
+    [{"a": 1, "b": 2}, {"a": 3, "b": 4}] -> {"columns": ["a", "b"], "rows": [[1, 2], [3, 4]]}
+    """
+    if not rows:
+        return {"columns": [], "rows": []}
+    columns = list(rows[0].keys())
+    return {
+        "columns": columns,
+        "rows": [[r.get(c) for c in columns] for r in rows],
+    }
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        coding, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick 'br', 'gzip' or None for the given Accept-Encoding header."""
+    accepted = _accepted_encodings(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates = []
+    if brotli is not None:
+        candidates.append("br")
+    candidates.append("gzip")
+
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """
+    Compress body according to Accept-Encoding.
+    Returns (body, content_encoding); content_encoding is None when left as-is.
+    """
+    if len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    coding = choose_encoding(accept_encoding)
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if coding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def encode_json(payload: Any, accept_encoding: Optional[str]) -> Tuple[bytes, Dict[str, str]]:
+    """Serialize + compress a payload. Returns (body, extra_headers)."""
+    body, coding = compress(dumps(payload), accept_encoding)
+    headers = {"Vary": "Accept-Encoding"}
+    if coding:
+        headers["Content-Encoding"] = coding
+    return body, headers
@@ -0,0 +1,280 @@
+"""
+Profile snapshots must answer exactly like MySQL, or refuse (SnapshotMiss).
+
+Expected values below follow MySQL semantics for each collation in COLLATIONS
+(utf8mb4_0900_ai_ci: NO PAD, accent-insensitive; utf8mb4_general_ci: PAD SPACE)
+and decimal division. Set SNAPSHOT_PARITY_DB to a scratch schema on the .env
+server to also run every query on MySQL and compare both paths directly.
+
+    cd backend && python -m pytest tests
+"""
+
+import os
+import sys
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profile_snapshot import ProfileSnapshot, ProfileSnapshotCache, SnapshotMiss  # noqa: E402
+
+UID = 7
+
+TABLES = {
+    "students": (
+        ["id", "name", "class", "password"],
+        [(7, "Åsa Kumar", "9A", "secret")],
+    ),
+    "attendance": (
+        ["id", "student_id", "date", "status"],
+        [
+            (1, 7, date(2025, 6, 1), "Present"),
+            (2, 7, date(2025, 6, 2), "present"),
+            (3, 7, date(2025, 6, 3), "ABSENT"),
+            (4, 7, date(2025, 6, 4), "present "),
+        ],
+    ),
+    "fee_payments": (
+        ["id", "student_id", "amount", "status"],
+        [(1, 7, Decimal("1500.00"), "Paid"), (2, 7, Decimal("500.00"), "pending")],
+    ),
+    "academic_marks": (
+        ["id", "student_id", "subject", "marks"],
+        [(1, 7, "Maths", 78), (2, 7, "Science", 45), (3, 7, "English", 91)],
+    ),
+}
+
+COLUMN_TYPES = {
+    "students": {"id": "int", "name": "varchar", "class": "varchar", "password": "varchar"},
+    "attendance": {"id": "int", "student_id": "int", "date": "date", "status": "varchar"},
+    "fee_payments": {"id": "int", "student_id": "int", "amount": "decimal", "status": "varchar"},
+    "academic_marks": {"id": "int", "student_id": "int", "subject": "varchar", "marks": "int"},
+}
+COLLATIONS = ["utf8mb4_0900_ai_ci", "utf8mb4_general_ci"]
+DDL_TYPES = {"int": "INT", "varchar": "VARCHAR(50)", "decimal": "DECIMAL(10,2)", "date": "DATE"}
+
+
+def column_info(collation):
+    return {
+        table: {c: (t, collation if t == "varchar" else None) for c, t in cols.items()}
+        for table, cols in COLUMN_TYPES.items()
+    }
+
+
+# sql -> rows MySQL returns (as tuples, numbers as float), or {collation: rows}
+HITS = {
+    # 'present ' only matches under PAD SPACE
+    "SELECT COUNT(*) AS n FROM attendance WHERE student_id = 7 AND status = 'present'": {
+        "utf8mb4_0900_ai_ci": [(2,)],
+        "utf8mb4_general_ci": [(3,)],
+    },
+    "SELECT id FROM fee_payments WHERE student_id = 7 AND status = 'paid'": [(1,)],
+    "SELECT id FROM fee_payments WHERE student_id = 7 AND status IN ('PENDING', 'due')": [(2,)],
+    "SELECT subject FROM academic_marks WHERE student_id = 7 AND LOWER(subject) LIKE '%math%'": [("Maths",)],
+    "SELECT name FROM students WHERE id = 7 AND name LIKE 'åsa%'": [("Åsa Kumar",)],
+    "SELECT name FROM students WHERE id = 7 AND name LIKE 'asa%'": [("Åsa Kumar",)],
+    "SELECT name FROM students WHERE id = 7 AND name = 'asa kumar'": [("Åsa Kumar",)],
+    "SELECT subject, marks FROM academic_marks WHERE student_id = 7 ORDER BY subject": [
+        ("English", 91), ("Maths", 78), ("Science", 45),
+    ],
+    "SELECT SUM(amount) AS total FROM fee_payments WHERE student_id = 7": [(2000.0,)],
+    "SELECT COUNT(*) AS n FROM attendance WHERE student_id = 7 GROUP BY status ORDER BY n": {
+        "utf8mb4_0900_ai_ci": [(1,), (1,), (2,)],
+        "utf8mb4_general_ci": [(1,), (3,)],
+    },
+    "SELECT id FROM attendance WHERE student_id = 7 AND date >= '2025-06-03' ORDER BY id": [(3,), (4,)],
+    "SELECT subject FROM academic_marks WHERE student_id = 7 AND marks BETWEEN 40 AND 80 ORDER BY id": [
+        ("Maths",), ("Science",),
+    ],
+    "SELECT id FROM fee_payments WHERE student_id IN (7, 8) AND amount > 1000": [(1,)],
+    "SELECT id FROM students WHERE class = '9a'": [(7,)],
+}
+
+# SQLite would run these, but its answer differs from MySQL's
+MISSES = [
+    # integer division on SQLite -> 0
+    "SELECT SUM(CASE WHEN status = 'present' THEN 1 ELSE 0 END) / COUNT(*) * 100 FROM attendance "
+    "WHERE student_id = 7",
+    "SELECT id FROM fee_payments WHERE student_id = 7 AND LOWER(status) = 'Paid'",
+    "SELECT id FROM academic_marks WHERE student_id = 7 AND marks > '50'",
+    "SELECT COUNT(*) AS n FROM attendance WHERE student_id = 7 HAVING COUNT(*) > '2'",
+    # MySQL compares text columns with numbers numerically ('9A' = 9), SQLite as text
+    "SELECT id FROM students WHERE id = 7 AND class = 9",
+    "SELECT id FROM students WHERE id = 7 AND 9 = class",
+    "SELECT id FROM students WHERE id = 7 AND class IN (8, 9)",
+    "SELECT id FROM students WHERE id = 7 AND class BETWEEN 9 AND 10",
+    "SELECT id FROM students WHERE id = 7 AND class + 0 = 9",
+    "SELECT id FROM academic_marks WHERE student_id = 7 AND marks > 'fifty'",
+    "SELECT CONCAT(name, NULL) FROM students WHERE id = 7",
+    "SELECT name || class FROM students WHERE id = 7",
+    "SELECT id FROM attendance WHERE student_id = 7 AND status = \"present\"",
+    "SELECT a.id FROM attendance a JOIN students s ON s.id = a.student_id WHERE a.student_id = 7",
+    "SELECT id FROM attendance, students WHERE attendance.student_id = 7",
+    "SELECT id FROM attendance WHERE student_id = (SELECT id FROM students WHERE id = 7)",
+    "SELECT * FROM teachers",
+]
+
+
+def _normalize(rows):
+    out = []
+    for r in rows:
+        values = r.values() if isinstance(r, dict) else r
+        out.append(tuple(
+            float(v) if isinstance(v, Decimal) else v.isoformat() if isinstance(v, date) else v
+            for v in values
+        ))
+    return out
+
+
+def _expected(sql, collation):
+    rows = HITS[sql]
+    return rows[collation] if isinstance(rows, dict) else rows
+
+
+@pytest.fixture(params=COLLATIONS)
+def snapshot(request):
+    snap = ProfileSnapshot(UID, TABLES, column_info(request.param))
+    snap.collation = request.param
+    yield snap
+    snap.close()
+
+
+@pytest.mark.parametrize("sql", list(HITS))
+def test_snapshot_matches_mysql(snapshot, sql):
+    assert _normalize(snapshot.query(sql)) == _expected(sql, snapshot.collation)
+
+
+@pytest.mark.parametrize("sql", MISSES)
+def test_non_portable_sql_falls_back(snapshot, sql):
+    with pytest.raises(SnapshotMiss):
+        snapshot.query(sql)
+
+
+def test_password_not_copied(snapshot):
+    assert "password" not in snapshot.query("SELECT * FROM students WHERE id = 7")[0]
+
+
+def test_unmirrored_collation_falls_back():
+    info = column_info("utf8mb4_general_ci")
+    info["attendance"]["status"] = ("varchar", "latin1_swedish_ci")
+    snap = ProfileSnapshot(UID, TABLES, info)
+    try:
+        with pytest.raises(SnapshotMiss):
+            snap.query("SELECT id FROM attendance WHERE student_id = 7 AND status = 'present'")
+        assert _normalize(snap.query("SELECT COUNT(*) FROM attendance WHERE student_id = 7")) == [(4,)]
+    finally:
+        snap.close()
+
+
+def test_like_needs_one_collation():
+    info = column_info("utf8mb4_general_ci")
+    info["attendance"]["status"] = ("varchar", "utf8mb4_bin")
+    snap = ProfileSnapshot(UID, TABLES, info)
+    try:
+        # SQLite's like() can't follow two collations at once
+        with pytest.raises(SnapshotMiss):
+            snap.query("SELECT id FROM students WHERE id = 7 AND name LIKE 'a%'")
+        rows = snap.query("SELECT id FROM attendance WHERE student_id = 7 AND status = 'present' ORDER BY id")
+        assert _normalize(rows) == [(2,), (4,)]
+    finally:
+        snap.close()
+
+
+def test_binary_collation_is_case_sensitive():
+    snap = ProfileSnapshot(UID, TABLES, column_info("utf8mb4_bin"))
+    try:
+        rows = snap.query("SELECT id FROM attendance WHERE student_id = 7 AND status = 'present' ORDER BY id")
+        assert _normalize(rows) == [(2,), (4,)]
+        assert snap.query("SELECT id FROM fee_payments WHERE student_id = 7 AND status LIKE 'paid'") == []
+    finally:
+        snap.close()
+
+
+class _MultiCursor:
+    """mysql-connector 8.3 multi=True: every step yields the same cursor object."""
+
+    def __init__(self, results):
+        self._results = results
+        self.column_names = ()
+        self.with_rows = False
+        self._unread = False
+
+    def execute(self, sql, params=None, multi=False):
+        if not multi:
+            assert sql.startswith("SELECT TABLE_NAME")
+            self._rows = [(t, c, *v) for t, cols in column_info("utf8mb4_0900_ai_ci").items() for c, v in cols.items()]
+            return None
+        return self._results_gen()
+
+    def _results_gen(self):
+        for columns, rows in self._results:
+            if self._unread:
+                raise RuntimeError("Unread result found")
+            self.column_names, self._rows = tuple(columns), list(rows)
+            self.with_rows = self._unread = True
+            yield self
+
+    def fetchall(self):
+        self._unread = False
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class _Conn:
+    def __init__(self, results):
+        self._results = results
+
+    def cursor(self):
+        return _MultiCursor(self._results)
+
+    def close(self):
+        pass
+
+
+def test_fetch_rows_reads_each_result_set():
+    from profile_snapshot import SNAPSHOT_TABLES
+
+    results = [([f"{t}_col"], [(t,)]) for t in SNAPSHOT_TABLES]
+    cache = ProfileSnapshotCache(lambda: _Conn(results))
+    out = cache.fetch_rows(UID)
+    assert cache.column_info == column_info("utf8mb4_0900_ai_ci")
+    assert list(out) == list(SNAPSHOT_TABLES)
+    for t, (columns, rows) in out.items():
+        assert columns == [f"{t}_col"] and rows == [(t,)]
+
+
+@pytest.mark.skipif(not os.environ.get("SNAPSHOT_PARITY_DB"), reason="set SNAPSHOT_PARITY_DB to a scratch schema")
+def test_parity_against_mysql(snapshot):
+    from dotenv import load_dotenv
+    import mysql.connector
+
+    load_dotenv()
+    database = os.environ["SNAPSHOT_PARITY_DB"]
+    assert database != os.environ.get("MYSQL_DB"), "use a scratch schema"
+    conn = mysql.connector.connect(
+        host=os.environ.get("MYSQL_HOST"),
+        user=os.environ.get("MYSQL_USER"),
+        password=os.environ.get("MYSQL_PASSWORD"),
+        database=database,
+        port=int(os.environ.get("MYSQL_PORT", 3306)),
+    )
+    cur = conn.cursor(buffered=True)
+    try:
+        for table, (columns, rows) in TABLES.items():
+            cur.execute(f"DROP TABLE IF EXISTS `{table}`")
+            cols = ", ".join(f"`{c}` {DDL_TYPES[COLUMN_TYPES[table][c]]}" for c in columns)
+            cur.execute(f"CREATE TABLE `{table}` ({cols}) DEFAULT CHARSET utf8mb4 COLLATE {snapshot.collation}")
+            marks = ", ".join(["%s"] * len(columns))
+            cur.executemany(f"INSERT INTO `{table}` VALUES ({marks})", rows)
+        conn.commit()
+        for sql in HITS:
+            cur.execute(sql)
+            assert _normalize(snapshot.query(sql)) == _normalize(cur.fetchall()), sql
+    finally:
+        for table in TABLES:
+            cur.execute(f"DROP TABLE IF EXISTS `{table}`")
+        conn.close()
@@ -0,0 +1,160 @@
+"""
+Scheduler: stride shares between classes, bounded queues, and a student burst
+on a Starlette-sized threadpool not delaying teacher requests.
+
+    cd backend && python -m pytest tests
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import DEFAULT_CLASSES, DEFAULT_THREADPOOL_SIZE, Scheduler, SchedulerRejected, SlotPool  # noqa: E402
+
+
+def _wait_for(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def _grant_order(pool, waiters):
+    """Queue `waiters` (class names, in order) behind a held slot; return the order slots go out in."""
+    pool.acquire("kpi", timeout=1)
+    order = []
+    lock = threading.Lock()
+
+    def wait(klass):
+        pool.acquire(klass, timeout=5)
+        with lock:
+            order.append(klass)
+
+    threads = []
+    for i, klass in enumerate(waiters):
+        t = threading.Thread(target=wait, args=(klass,), daemon=True)
+        t.start()
+        threads.append(t)
+        _wait_for(lambda: sum(len(q) for q in pool._queues.values()) == i + 1)
+    for n in range(len(waiters)):
+        pool.release()
+        _wait_for(lambda: len(order) == n + 1)
+    for t in threads:
+        t.join(1)
+    return order
+
+
+def test_stride_shares_slots_by_weight():
+    pool = SlotPool("llm", 1, DEFAULT_CLASSES)
+    order = _grant_order(pool, ["student_chat"] * 9 + ["teacher_chat"] * 9)
+    # 6:3 - the teacher queue gets two slots for each student slot while both wait
+    assert order[:9].count("teacher_chat") == 6
+    assert order[:9].count("student_chat") == 3
+
+
+def test_idle_class_does_not_bank_credit():
+    pool = SlotPool("llm", 1, DEFAULT_CLASSES)
+    for _ in range(50):
+        pool.acquire("teacher_chat", timeout=1)
+        pool.release()
+    # the students were idle meanwhile: they join at the current virtual time
+    order = _grant_order(pool, ["student_chat"] * 6 + ["teacher_chat"] * 6)
+    assert order[:6].count("teacher_chat") >= 3
+
+
+def test_full_queue_and_timeout_are_rejected():
+    classes = {"kpi": {"weight": 1, "max_queue": 1, "per_user": 1, "max_active": 1}}
+    pool = SlotPool("db", 1, classes)
+    pool.acquire("kpi", timeout=1)
+    with pytest.raises(SchedulerRejected) as e:
+        pool.acquire("kpi", timeout=0.01)
+    assert e.value.status_code == 503
+    assert pool.timeouts["kpi"] == 1 and not pool._queues["kpi"]
+
+    waiter = threading.Thread(target=lambda: pool.acquire("kpi", timeout=5), daemon=True)
+    waiter.start()
+    _wait_for(lambda: len(pool._queues["kpi"]) == 1)
+    with pytest.raises(SchedulerRejected):
+        pool.acquire("kpi", timeout=1)
+    assert pool.rejected["kpi"] == 1
+    pool.release()
+    waiter.join(1)
+    assert pool.in_use == 1
+
+
+def test_class_cap_rejects_at_admission():
+    scheduler = Scheduler(1, 1, 1)
+    cap = DEFAULT_CLASSES["student_chat"]["max_active"]
+    held = [scheduler.admit("student_chat", uid) for uid in range(cap)]
+    for ctx in held:
+        ctx.__enter__()
+    with pytest.raises(SchedulerRejected) as e:
+        with scheduler.admit("student_chat", "one more"):
+            pass
+    assert e.value.status_code == 503
+    # other classes are unaffected
+    with scheduler.admit("teacher_chat", "t1"):
+        pass
+    for ctx in held:
+        ctx.__exit__(None, None, None)
+    with scheduler.admit("student_chat", "one more"):
+        pass
+
+
+def test_caps_must_fit_the_threadpool():
+    with pytest.raises(ValueError):
+        Scheduler(4, 8, 20, threadpool_size=20)
+
+
+def test_student_burst_does_not_delay_teacher():
+    """
+    200 students at once on a 40-thread pool (what Starlette runs sync endpoints
+    on), each holding an LLM slot for 20 ms. Without admission caps the queued
+    students take every thread and the teacher request waits ~1 s for a thread.
+    """
+    scheduler = Scheduler(llm_slots=4, db_slots=8, queue_timeout=5)
+    hold = 0.02
+
+    def request(klass, user_id):
+        start = time.perf_counter()
+        try:
+            with scheduler.admit(klass, user_id):
+                with scheduler.slot("llm"):
+                    waited = time.perf_counter() - start
+                    time.sleep(hold)
+        except SchedulerRejected as e:
+            return e.status_code, time.perf_counter() - start
+        return 200, waited
+
+    with ThreadPoolExecutor(max_workers=DEFAULT_THREADPOOL_SIZE) as pool:
+        students = [pool.submit(request, "student_chat", f"s{i}") for i in range(200)]
+        time.sleep(0.005)
+        submitted = time.perf_counter()
+        teacher = pool.submit(request, "teacher_chat", "t1")
+        status, _ = teacher.result(timeout=10)
+        teacher_latency = time.perf_counter() - submitted
+        outcomes = [f.result(timeout=10)[0] for f in students]
+
+    assert status == 200
+    # about one slot hold, not the ~1 s it takes to drain the whole burst
+    assert teacher_latency < 10 * hold
+    assert outcomes.count(503) > 0 and outcomes.count(200) >= DEFAULT_CLASSES["student_chat"]["max_active"]
+
+
+def test_export_hold_released_once():
+    scheduler = Scheduler(1, 1, 0.01, export_slots=1)
+    held = scheduler.hold("export", "teacher_chat")
+    with pytest.raises(SchedulerRejected):
+        scheduler.hold("export", "teacher_chat")
+    # the stream's finally and the response's background task both release
+    held.release()
+    held.release()
+    assert scheduler.pools["export"].in_use == 0
+    scheduler.hold("export", "teacher_chat").release()
+    assert scheduler.pools["export"].in_use == 0
@@ -1,31 +1,28 @@
 # flask_frontend/app.py
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response, stream_with_context
 from dotenv import load_dotenv
 import os
+import gzip
+import hashlib
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 import requests
 
-load_dotenv()
-import mysql.connector
-
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-# Load DB config from .env
-MYSQL_HOST = os.environ.get("MYSQL_HOST", "srv1085.hstgr.io")
-MYSQL_USER = os.environ.get("MYSQL_USER", "u477873453_std")
-MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD", "lR0$bUKGV*?b")
-MYSQL_DB = os.environ.get("MYSQL_DB", "u477873453_stmic")
-MYSQL_PORT = int(os.environ.get("MYSQL_PORT", 3306))
-
-def get_db_connection():
-    """Create database connection for KPI dashboard."""
-    return mysql.connector.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        database=MYSQL_DB,
-        port=MYSQL_PORT
-    )
+load_dotenv()
 
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
@@ -36,6 +33,9 @@ app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev_secret_change_me")
 # URL of your FastAPI backend
 BACKEND_BASE_URL = os.environ.get("BACKEND_BASE_URL", "http://127.0.0.1:8000")
 
+# KPI snapshot is recomputed at most once per this many seconds (shared by all teachers)
+KPI_CACHE_TTL_SECONDS = float(os.environ.get("KPI_CACHE_TTL_SECONDS", 30))
+
 
 # -------------------------
 # Helpers
@@ -51,6 +51,48 @@ def get_auth_headers():
     return {"Authorization": f"Bearer {token}"}
 
 
+# Headers copied from the backend /chat response onto ours (bytes are passed through as-is)
+PASSTHROUGH_HEADERS = ("Content-Type", "Content-Encoding", "Vary", "X-Trace-Id")
+MIN_COMPRESS_BYTES = 512
+
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, timedelta):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default)
+    return json.dumps(payload, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def fast_json_response(payload, status=200, headers=None):
+    """
+    jsonify() replacement: orjson when available, native Decimal/date handling,
+    and gzip/brotli compression negotiated from the browser's Accept-Encoding.
+    """
+    body = dump_json(payload)
+
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if len(body) >= MIN_COMPRESS_BYTES:
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            body = brotli.compress(body, quality=5)
+            headers["Content-Encoding"] = "br"
+        elif accepted["gzip"]:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+
+    return Response(body, status=status, mimetype="application/json", headers=headers)
+
+
 # -------------------------
 # Routes
 # -------------------------
@@ -154,12 +196,23 @@ def api_chat():
     if not message:
         return jsonify({"error": "Empty message"}), 400
 
+    # Forward the browser's Accept-Encoding so the backend compresses for it,
+    # then relay the body bytes untouched (no json decode / re-encode here).
+    headers = get_auth_headers()
+    headers["Accept-Encoding"] = request.headers.get("Accept-Encoding", "identity")
+
+    payload = {"message": message, "request_sql": False, "format": "columnar"}
+    # Teachers can ask the backend to trace this chat ("trace" / "flame")
+    if data.get("profile"):
+        payload["profile"] = data["profile"]
+
     try:
         resp = requests.post(
             f"{BACKEND_BASE_URL}/chat",
-            json={"message": message, "request_sql": False},
-            headers=get_auth_headers(),
-            timeout=30
+            json=payload,
+            headers=headers,
+            timeout=30,
+            stream=True
         )
     except Exception as e:
         return jsonify({"error": f"Backend error: {e}"}), 500
@@ -171,8 +224,49 @@ def api_chat():
             detail = "Chat error"
         return jsonify({"error": detail}), resp.status_code
 
-    chat_data = resp.json()
-    return jsonify(chat_data)
+    body = resp.raw.read(decode_content=False)
+    resp.close()
+    out_headers = {h: resp.headers[h] for h in PASSTHROUGH_HEADERS if h in resp.headers}
+    return Response(body, status=200, headers=out_headers)
+
+
+@app.route("/api/chat/export/<turn_id>")
+def api_chat_export(turn_id):
+    """
+    Frontend -> Flask -> FastAPI /chat/export/<turn_id>, streamed through chunk by chunk.
+    """
+    if not is_logged_in() or session.get("user_role") != "teacher":
+        return jsonify({"error": "Unauthorized"}), 403
+
+    fmt = request.args.get("format", "csv")
+    try:
+        resp = requests.get(
+            f"{BACKEND_BASE_URL}/chat/export/{turn_id}",
+            params={"format": fmt},
+            headers=get_auth_headers(),
+            timeout=(10, 300),
+            stream=True
+        )
+    except Exception as e:
+        return jsonify({"error": f"Backend error: {e}"}), 500
+
+    if resp.status_code != 200:
+        try:
+            detail = resp.json().get("detail", "Export error")
+        except Exception:
+            detail = "Export error"
+        retry = {"Retry-After": resp.headers["Retry-After"]} if "Retry-After" in resp.headers else {}
+        return jsonify({"error": detail}), resp.status_code, retry
+
+    def relay():
+        try:
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                yield chunk
+        finally:
+            resp.close()
+
+    headers = {h: resp.headers[h] for h in ("Content-Type", "Content-Disposition") if h in resp.headers}
+    return Response(stream_with_context(relay()), headers=headers)
 
 
 # 1. THE PAGE ROUTE (Renders the HTML)
@@ -184,78 +278,102 @@ def kpi_page():
     return render_template("kpi_dashboard.html") 
 
 # 2. THE API ROUTE (Returns the Data)
+def compute_kpi_snapshot():
+    """
+    Fetch the dashboard aggregates from the backend, which merges the
+    archived kpi_events rollups with the live table.
+    """
+    resp = requests.get(
+        f"{BACKEND_BASE_URL}/kpi/dashboard",
+        headers=get_auth_headers(),
+        timeout=30
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+# Day-bucketed series that support ?since= incremental fetches
+KPI_TREND_KEYS = ("usage_trend", "student_login_trend", "uptime_trend")
+
+_kpi_cache = {"data": None, "digest": None, "computed_at": 0.0, "changed_at": 0.0}
+_kpi_cache_lock = threading.Lock()
+
+
+def get_kpi_snapshot():
+    """
+    Return the shared KPI snapshot, recomputing it at most once per
+    KPI_CACHE_TTL_SECONDS. `changed_at` only moves when the data changes,
+    so it can back Last-Modified.
+    """
+    with _kpi_cache_lock:
+        now = time.time()
+        if _kpi_cache["data"] is None or now - _kpi_cache["computed_at"] >= KPI_CACHE_TTL_SECONDS:
+            data = compute_kpi_snapshot()
+            digest = hashlib.sha1(dump_json(data)).hexdigest()[:16]
+            if digest != _kpi_cache["digest"]:
+                _kpi_cache["changed_at"] = now
+            _kpi_cache.update(data=data, digest=digest, computed_at=now)
+        return dict(_kpi_cache)
+
+
+def _parse_since(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def _bucket_day(row):
+    day = row.get("day")
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, str):
+        return _parse_since(day)
+    return day
+
+
 @app.route("/api/kpi-data")
 def kpi_data():
+    """
+    Cached KPI snapshot with ETag / Last-Modified (unchanged data -> 304).
+    ?since=YYYY-MM-DD returns only trend buckets on or after that day
+    (the last bucket is re-sent because today's count is still growing).
+    """
     if not is_logged_in() or session.get("user_role") != "teacher":
         return jsonify({"error": "Unauthorized"}), 403
 
-    conn = get_db_connection()
-    cur = conn.cursor(dictionary=True)
-
-    # ---------- A. OVERALL STATS (chat + login) ----------
-    cur.execute("""
-        SELECT
-            COALESCE(SUM(CASE WHEN event_type LIKE 'chat_%' THEN 1 ELSE 0 END), 0) AS total_queries,
-            COALESCE(SUM(CASE WHEN event_type = 'chat_success' THEN 1 ELSE 0 END), 0) AS success_count,
-            COALESCE(SUM(CASE WHEN event_type IN ('chat_error','chat_ai_error','chat_db_error')
-                              THEN 1 ELSE 0 END), 0) AS error_count,
-            COALESCE(SUM(CASE WHEN event_type = 'login_success' THEN 1 ELSE 0 END), 0) AS login_success,
-            COALESCE(SUM(CASE WHEN event_type = 'login_failed' THEN 1 ELSE 0 END), 0) AS login_failed,
-            COALESCE(AVG(CASE WHEN event_type LIKE 'chat_%' THEN latency_ms END), 0) AS avg_response_time
-        FROM kpi_events;
-    """)
-    stats = cur.fetchone()
-
-    # ---------- B. DAILY USAGE TREND (all chat events) ----------
-    cur.execute("""
-        SELECT DATE(ts) AS day, COUNT(*) AS count
-        FROM kpi_events
-        WHERE event_type LIKE 'chat_%'
-        GROUP BY DATE(ts)
-        ORDER BY day ASC;
-    """)
-    usage_trend = cur.fetchall()
-
-    # ---------- C. TEACHER USAGE (top 5) ----------
-    cur.execute("""
-        SELECT user_id, COUNT(*) AS count
-        FROM kpi_events
-        WHERE role = 'teacher' AND event_type LIKE 'chat_%'
-        GROUP BY user_id
-        ORDER BY count DESC
-        LIMIT 5;
-    """)
-    teacher_usage = cur.fetchall()
-
-    # ---------- D. STUDENT LOGIN TREND ----------
-    cur.execute("""
-        SELECT DATE(ts) AS day, COUNT(*) AS count
-        FROM kpi_events
-        WHERE role = 'student' AND event_type = 'login_success'
-        GROUP BY DATE(ts)
-        ORDER BY day ASC;
-    """)
-    student_login_trend = cur.fetchall()
-
-    # ---------- E. SYSTEM UPTIME / ACTIVITY PER DAY ----------
-    # (proxy: number of events per day – higher = more active/available)
-    cur.execute("""
-        SELECT DATE(ts) AS day, COUNT(*) AS count
-        FROM kpi_events
-        GROUP BY DATE(ts)
-        ORDER BY day ASC;
-    """)
-    uptime_trend = cur.fetchall()
-
-    conn.close()
-
-    return jsonify({
-        "stats": stats,
-        "usage_trend": usage_trend,
-        "teacher_usage": teacher_usage,
-        "student_login_trend": student_login_trend,
-        "uptime_trend": uptime_trend,
-    })
+    since = _parse_since(request.args.get("since"))
+    try:
+        snapshot = get_kpi_snapshot()
+    except Exception as e:
+        return jsonify({"error": f"Backend error: {e}"}), 502
+
+    etag = snapshot["digest"] + (f"-{since.isoformat()}" if since else "")
+    last_modified = datetime.utcfromtimestamp(int(snapshot["changed_at"]))
+    conditional_headers = {
+        "ETag": f'"{etag}"',
+        "Last-Modified": last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+        "Cache-Control": "private, no-cache",
+    }
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        ims = request.if_modified_since
+        not_modified = ims is not None and ims.replace(tzinfo=None) >= last_modified
+    if not_modified:
+        return Response(status=304, headers=conditional_headers)
+
+    payload = dict(snapshot["data"])
+    if since:
+        for key in KPI_TREND_KEYS:
+            payload[key] = [r for r in payload[key] if _bucket_day(r) and _bucket_day(r) >= since]
+    payload["since"] = since
+    payload["generated_at"] = datetime.utcfromtimestamp(snapshot["computed_at"])
+
+    return fast_json_response(payload, headers=conditional_headers)
 
 
 if __name__ == "__main__":